@@ -0,0 +1,86 @@
+import time
+from collections import OrderedDict
+
+
+class AvatarEntry:
+    """某个QQ号头像的新鲜度信息与各模型的识别结果"""
+
+    __slots__ = ("digest", "etag", "last_modified", "checked_at", "results")
+
+    def __init__(self, digest: str, etag: str = None, last_modified: str = None):
+        self.digest = digest
+        self.etag = etag
+        self.last_modified = last_modified
+        self.checked_at = time.monotonic()
+        self.results = {}  # model -> AnimeTrace 返回结果
+
+    def conditional_headers(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class AvatarCache:
+    """按QQ号缓存头像识别结果
+
+    在 ttl_seconds 内直接复用结果；过期后用条件请求（ETag/Last-Modified）重新验证，
+    只有头像内容哈希真正变化时才需要重新调用识别API。
+    """
+
+    def __init__(self, ttl_seconds: float = 600, max_entries: int = 2000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # uin -> AvatarEntry
+        self.hits = 0
+        self.revalidated = 0
+        self.changed = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, uin: str):
+        entry = self._entries.get(uin)
+        if entry is not None:
+            self._entries.move_to_end(uin)
+        return entry
+
+    def is_fresh(self, entry: AvatarEntry) -> bool:
+        return time.monotonic() - entry.checked_at < self.ttl_seconds
+
+    def put(self, uin: str, entry: AvatarEntry):
+        self._entries[uin] = entry
+        self._entries.move_to_end(uin)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def snapshot(self) -> list:
+        """导出全部条目，检查时间换算为墙钟时间以便重启后继续计算新鲜度"""
+        offset = time.time() - time.monotonic()
+        return [
+            (uin, e.digest, e.etag, e.last_modified, e.checked_at + offset, e.results)
+            for uin, e in self._entries.items()
+        ]
+
+    def restore(self, entries) -> int:
+        offset = time.time() - time.monotonic()
+        restored = 0
+        for uin, digest, etag, last_modified, checked_at, results in entries:
+            if uin in self._entries:
+                continue
+            entry = AvatarEntry(digest, etag, last_modified)
+            entry.checked_at = checked_at - offset  # 停机时间也计入新鲜度
+            entry.results = results
+            self.put(uin, entry)
+            restored += 1
+        return restored
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "changed": self.changed,
+        }
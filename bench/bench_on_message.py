@@ -0,0 +1,111 @@
+"""on_message 快速路径微基准
+
+测量 on_message 在不相关消息（无等待会话、无触发关键词）上的单条消息开销，
+并与旧实现（逐段字符串拼接 + 多次 f-string 调试日志 + 三次 re.search）对比。
+
+需要在安装了 AstrBot 的环境中运行（插件目录即为一个 Python 包）：
+
+    python bench/bench_on_message.py --messages 20000
+"""
+import argparse
+import asyncio
+import importlib
+import logging
+import os
+import re
+import sys
+import time
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+plugin_main = importlib.import_module(f"{os.path.basename(PLUGIN_DIR)}.main")
+
+from astrbot.api import logger  # noqa: E402
+from astrbot.api.message_components import Plain  # noqa: E402
+
+
+class FakeEvent:
+    """只实现 on_message 用到的接口"""
+
+    def __init__(self, chain, sender_id="10001", group_id="20001"):
+        self._chain = chain
+        self._sender_id = sender_id
+        self._group_id = group_id
+        self.unified_msg_origin = f"bench:GroupMessage:{group_id}"
+
+    def get_messages(self):
+        return self._chain
+
+    def get_sender_id(self):
+        return self._sender_id
+
+    def get_group_id(self):
+        return self._group_id
+
+    def get_platform_name(self):
+        return "bench"
+
+
+SAMPLE_TEXTS = [
+    "早上好",
+    "今天的活动大家都参加了吗？记得下午三点在群里集合",
+    "哈哈哈哈哈哈哈哈",
+    "有没有人知道这个番叫什么名字，看起来很好看的样子" * 3,
+]
+
+
+async def legacy_on_message(event):
+    """旧版 on_message 在不相关消息上执行的逻辑（仅用于对比）"""
+    messages = event.get_messages()
+    full_text = ""
+    logger.debug(f"on_message收到消息，消息列表: {messages}")
+    for msg in messages:
+        logger.debug(f"处理消息组件: type={getattr(msg, 'type', '无type')}, text={getattr(msg, 'text', '无text')}")
+        if hasattr(msg, "text"):
+            full_text += str(msg.text)
+        elif hasattr(msg, "type") and msg.type == "Plain":
+            full_text += str(msg)
+    logger.debug(f"提取的完整文本: '{full_text}'")
+    if not hasattr(event, "_avatar_command_processed"):
+        for pattern in (r"头像动漫识别", r"头像gal识别", r"头像识别"):
+            if re.search(pattern, full_text):
+                return
+    waiting_sessions = {}
+    if event.get_sender_id() not in waiting_sessions:
+        return
+    yield None  # 使其成为异步生成器，与 on_message 一致
+
+
+async def measure(handler, events) -> float:
+    start = time.perf_counter_ns()
+    for event in events:
+        async for _ in handler(event):
+            pass
+    return (time.perf_counter_ns() - start) / len(events)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000, help="每轮处理的消息数")
+    parser.add_argument("--rounds", type=int, default=5, help="测量轮数（取最好成绩）")
+    args = parser.parse_args()
+
+    logger.setLevel(logging.INFO)  # 与生产环境一致：调试日志关闭
+    plugin = plugin_main.AnimeTracePlugin(object(), {"shitu_settings": {"cache_enabled": False}})
+    events = [
+        FakeEvent([Plain(SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)])], sender_id=str(10000 + i % 500))
+        for i in range(args.messages)
+    ]
+
+    results = {}
+    for name, handler in (("legacy", legacy_on_message), ("on_message", plugin.on_message)):
+        await measure(handler, events[:1000])  # 预热
+        results[name] = min([await measure(handler, events) for _ in range(args.rounds)])
+
+    for name, ns in results.items():
+        print(f"{name:>12}: {ns / 1000:8.2f} µs/消息")
+    print(f"{'speedup':>12}: {results['legacy'] / results['on_message']:8.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,212 @@
+"""识别流程离线基准
+
+在子进程中启动本地 AnimeTrace 替身服务（见 fake_animetrace.py），用伪造的消息事件
+以指定并发驱动 AnimeTracePlugin 的识别命令，统计端到端延迟 p50/p95/p99、吞吐量、
+峰值内存和事件循环延迟。升级依赖或修改识别流程前后各跑一次即可发现性能回退。
+
+需要在安装了 AstrBot 的环境中运行（插件目录即为一个 Python 包）：
+
+    python bench/bench_recognition.py --requests 300 --concurrency 30 --error-rate 0.05
+    python bench/bench_recognition.py --config '{"scheduler_rate_per_second": 0, "cache_enabled": false}'
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import resource
+import socket
+import sys
+import time
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+sys.path.insert(0, BENCH_DIR)
+plugin_main = importlib.import_module(f"{os.path.basename(PLUGIN_DIR)}.main")
+
+from astrbot.api import logger  # noqa: E402
+from astrbot.api.message_components import Image, Plain  # noqa: E402
+
+from fake_animetrace import add_server_arguments, server_argv  # noqa: E402
+
+COMMANDS = {
+    "pre_stable": "anime_search",
+    "full_game_model_kira": "gal_search",
+    "animetrace_high_beta": "trace_search",
+    "all": "all_models_search",
+}
+FAILURE_PREFIXES = ("❌", "🚧", "⏳", "⏰")
+
+
+class FakeEvent:
+    """只实现识别命令用到的接口；send() 记录回复"""
+
+    def __init__(self, chain, sender_id: str, group_id: str):
+        self._chain = chain
+        self._sender_id = sender_id
+        self._group_id = group_id
+        self.unified_msg_origin = f"bench:GroupMessage:{group_id}"
+        self.replies = []
+
+    def get_messages(self):
+        return self._chain
+
+    def get_sender_id(self):
+        return self._sender_id
+
+    def get_group_id(self):
+        return self._group_id
+
+    def get_platform_name(self):
+        return "bench"
+
+    def plain_result(self, text: str):
+        return text
+
+    async def send(self, result):
+        self.replies.append(result)
+
+
+def percentile(ordered: list, q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+async def monitor_loop_lag(samples: list, interval: float = 0.01):
+    """定时唤醒并记录实际唤醒时间与预期的差值"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_server(args):
+    """在子进程中启动替身服务，等待端口可用"""
+    port = free_port()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(BENCH_DIR, "fake_animetrace.py"), "--port", str(port), *server_argv(args)
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            try:
+                async with session.get(f"{base_url}/stats"):
+                    return process, base_url
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.1)
+    process.kill()
+    raise RuntimeError("替身服务启动失败")
+
+
+async def run(args, base_url: str) -> dict:
+    shitu_settings = {"cache_persistent": False}
+    shitu_settings.update(json.loads(args.config))
+    plugin = plugin_main.AnimeTracePlugin(object(), {"shitu_settings": shitu_settings})
+    plugin.api_url = f"{base_url}/v1/search"
+    await plugin.initialize()
+    handler = getattr(plugin, COMMANDS[args.model])
+
+    lag_samples = []
+    lag_task = asyncio.create_task(monitor_loop_lag(lag_samples))
+    latencies = []
+    outcomes = {"ok": 0, "failed": 0}
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(i)
+
+    async def worker():
+        while not queue.empty():
+            i = queue.get_nowait()
+            image_url = f"{base_url}/img/{i % args.unique_images}.jpg"
+            event = FakeEvent(
+                [Plain("识别"), Image.fromURL(image_url)],
+                sender_id=str(10000 + i % args.users),
+                group_id=str(20000 + i % args.groups),
+            )
+            start = time.perf_counter()
+            async for _ in handler(event):
+                pass  # 开启LLM交接时忽略产生的LLM请求
+            latencies.append(time.perf_counter() - start)
+            last = str(event.replies[-1]) if event.replies else ""
+            outcomes["failed" if not last or last.startswith(FAILURE_PREFIXES) else "ok"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    lag_task.cancel()
+    status = plugin.format_status()
+    await plugin.terminate()
+
+    latencies.sort()
+    lag_samples.sort()
+    return {
+        "elapsed": elapsed,
+        "latencies": latencies,
+        "lag": lag_samples,
+        "outcomes": outcomes,
+        "status": status,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="识别请求总数")
+    parser.add_argument("--concurrency", type=int, default=20, help="同时进行的请求数")
+    parser.add_argument("--unique-images", type=int, default=100, help="不同图片的数量（小于请求数时会命中缓存）")
+    parser.add_argument("--users", type=int, default=50, help="模拟的用户数")
+    parser.add_argument("--groups", type=int, default=5, help="模拟的群组数")
+    parser.add_argument("--model", choices=sorted(COMMANDS), default="pre_stable", help="识别模型（all 为全部识别）")
+    parser.add_argument("--config", default="{}", help="覆盖插件配置的JSON，如 '{\"cache_enabled\": false}'")
+    parser.add_argument("--show-status", action="store_true", help="结束后输出 识图状态 的内容")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+    process, base_url = await start_server(args)
+    try:
+        result = await run(args, base_url)
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{base_url}/stats") as response:
+                server_requests = await response.json()
+    finally:
+        process.terminate()
+        await process.wait()
+
+    latencies = result["latencies"]
+    lag = result["lag"]
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak_rss //= 1024  # macOS 以字节为单位
+    print(f"请求数:       {len(latencies)}（成功 {result['outcomes']['ok']}，失败 {result['outcomes']['failed']}）")
+    print(f"并发:         {args.concurrency}")
+    print(f"总耗时:       {result['elapsed']:.2f} s")
+    print(f"吞吐量:       {len(latencies) / result['elapsed']:.2f} 请求/秒")
+    print(
+        "延迟:         "
+        + " / ".join(f"p{int(q * 100)} {percentile(latencies, q) * 1000:.0f}ms" for q in (0.5, 0.95, 0.99))
+        + f" / max {latencies[-1] * 1000:.0f}ms"
+    )
+    print(
+        f"事件循环延迟: p99 {percentile(lag, 0.99) * 1000:.1f}ms / max {(lag[-1] if lag else 0) * 1000:.1f}ms"
+    )
+    print(f"峰值内存:     {peak_rss / 1024:.1f} MB")
+    print(f"上游请求:     {server_requests}")
+    if args.show_status:
+        print()
+        print(result["status"])
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
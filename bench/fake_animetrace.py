@@ -0,0 +1,119 @@
+"""本地 AnimeTrace 替身服务
+
+模拟 /v1/search 接口（url、base64、multipart 文件三种提交方式），可配置延迟、
+错误率以及 422/5xx 注入；同时提供本地图片源 /img/<编号>.jpg，供离线基准测试使用。
+
+单独运行：
+
+    python bench/fake_animetrace.py --port 8901 --latency-ms 300 --error-rate 0.05
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+from io import BytesIO
+
+from aiohttp import web
+from PIL import Image as PILImage
+
+CHARACTERS = [("初音未来", "VOCALOID"), ("雷姆", "Re:从零开始的异世界生活"), ("阿尔托莉雅", "Fate/stay night"),
+              ("御坂美琴", "某科学的超电磁炮"), ("时崎狂三", "约会大作战"), ("芙莉莲", "葬送的芙莉莲")]
+
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group("AnimeTrace 替身服务")
+    group.add_argument("--latency-ms", type=float, default=300, help="识别接口的平均延迟")
+    group.add_argument("--jitter-ms", type=float, default=100, help="延迟的随机波动范围（±）")
+    group.add_argument("--error-rate", type=float, default=0.0, help="返回 500/502/503 的比例")
+    group.add_argument("--reject-rate", type=float, default=0.0, help="返回 422 的比例")
+    group.add_argument("--url-fail-rate", type=float, default=0.0, help="URL方式返回 500（无法获取图片）的比例")
+    group.add_argument("--image-size", type=int, default=1280, help="图片源生成图片的最长边")
+    group.add_argument("--seed", type=int, default=0, help="随机种子")
+
+
+def server_argv(args) -> list:
+    """把解析后的参数还原为命令行，用于在子进程中启动服务"""
+    return [
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+        "--error-rate", str(args.error_rate), "--reject-rate", str(args.reject_rate),
+        "--url-fail-rate", str(args.url_fail_rate), "--image-size", str(args.image_size),
+        "--seed", str(args.seed),
+    ]
+
+
+def render_image(index: int, size: int) -> bytes:
+    """按编号生成确定的图片（不同编号的感知哈希互不相近）"""
+    rng = random.Random(index)
+    small = PILImage.new("RGB", (16, 12))
+    small.putdata([tuple(rng.randrange(256) for _ in range(3)) for _ in range(16 * 12)])
+    img = small.resize((size, size * 3 // 4), PILImage.BICUBIC)
+    buffered = BytesIO()
+    img.save(buffered, format="JPEG", quality=90)
+    return buffered.getvalue()
+
+
+class FakeAnimeTrace:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.images = {}
+        self.requests = {"url": 0, "base64": 0, "file": 0}
+
+    async def search(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        if "url" in form:
+            mode, key = "url", str(form["url"]).encode()
+        elif "file" in form:
+            mode, key = "file", form["file"].file.read()
+        else:
+            mode, key = "base64", str(form.get("base64", "")).encode()
+        self.requests[mode] += 1
+
+        args = self.args
+        delay = max(0.0, args.latency_ms + self.rng.uniform(-args.jitter_ms, args.jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+
+        roll = self.rng.random()
+        if roll < args.error_rate:
+            return web.Response(status=self.rng.choice((500, 502, 503)), text="injected error")
+        if roll < args.error_rate + args.reject_rate:
+            return web.Response(status=422, text="injected reject")
+        if mode == "url" and self.rng.random() < args.url_fail_rate:
+            return web.Response(status=500, text="cannot fetch url")
+
+        # 按提交内容确定返回的角色，保证同一张图片结果一致
+        digest = hashlib.blake2b(key, digest_size=8).digest()
+        picks = [CHARACTERS[b % len(CHARACTERS)] for b in digest[:3]]
+        return web.json_response(
+            {"code": 0, "data": [{"character": [{"character": name, "work": work} for name, work in picks]}]}
+        )
+
+    async def image(self, request: web.Request) -> web.Response:
+        index = int(request.match_info["index"])
+        data = self.images.get(index)
+        if data is None:
+            data = self.images[index] = render_image(index, self.args.image_size)
+        return web.Response(body=data, content_type="image/jpeg")
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.requests)
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/v1/search", self.search)
+        app.router.add_get("/img/{index:\\d+}.jpg", self.image)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(FakeAnimeTrace(args).make_app(), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
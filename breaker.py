@@ -0,0 +1,161 @@
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被直接拒绝"""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"识别服务暂时不可用，{retry_in:.0f} 秒后重试")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """AnimeTrace 接口熔断器与自适应超时
+
+    - 关闭：正常放行；最近 window 次调用中失败（含超过 slow_call_seconds 的慢调用）
+      比例达到 failure_rate 时打开
+    - 打开：直接拒绝请求，open_seconds 后进入半开；连续重新打开时冷却时间翻倍
+    - 半开：只放行一个探测请求，成功则关闭，失败则重新打开
+    - 自适应超时：按最近成功调用耗时的p95乘以 timeout_multiplier，限制在
+      [min_timeout, max_timeout] 之间；样本不足时使用 max_timeout
+    """
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        min_samples: int = 10,
+        window: int = 20,
+        open_seconds: float = 30.0,
+        max_open_seconds: float = 300.0,
+        slow_call_seconds: float = 10.0,
+        min_timeout: float = 5.0,
+        max_timeout: float = 30.0,
+        timeout_multiplier: float = 3.0,
+        on_state_change=None,
+    ):
+        self.failure_rate = failure_rate
+        self.min_samples = min_samples
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.on_state_change = on_state_change  # def on_state_change(old, new, reason)
+
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)  # True 表示失败或慢调用
+        self._latencies = deque(maxlen=100)  # 最近成功调用的耗时
+        self._timeout = max_timeout
+        self._opened_at = 0.0
+        self._cooldown = open_seconds
+        self._probing = False
+
+        self.transitions = {OPEN: 0, HALF_OPEN: 0, CLOSED: 0}
+        self.rejected = 0
+        self.failures = 0
+        self.successes = 0
+
+    def _set_state(self, state: str, reason: str):
+        old, self.state = self.state, state
+        self.transitions[state] += 1
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if self.on_state_change is not None:
+            self.on_state_change(old, state, reason)
+
+    def retry_in(self) -> float:
+        """打开状态下距离进入半开的剩余秒数"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self._cooldown - time.monotonic())
+
+    def is_open(self) -> bool:
+        """是否会拒绝下一个请求（不占用半开探测名额）"""
+        if self.state == OPEN:
+            return self.retry_in() > 0
+        return self.state == HALF_OPEN and self._probing
+
+    def before_call(self) -> bool:
+        """请求发出前调用：被熔断时抛出 CircuitOpenError，返回本次请求是否为半开探测"""
+        if self.state == OPEN:
+            retry_in = self.retry_in()
+            if retry_in > 0:
+                self.rejected += 1
+                raise CircuitOpenError(retry_in)
+            self._set_state(HALF_OPEN, f"冷却 {self._cooldown:.0f} 秒结束")
+        if self.state == HALF_OPEN:
+            if self._probing:
+                self.rejected += 1
+                raise CircuitOpenError(self._cooldown)
+            self._probing = True
+            return True
+        return False
+
+    def request_timeout(self) -> float:
+        """当前请求的总超时时间（秒）"""
+        return self._timeout
+
+    def record(self, ok, latency: float, probe: bool = False):
+        """记录一次调用结果：ok 为None表示调用被取消（只归还半开探测名额）"""
+        probing = probe and self.state == HALF_OPEN
+        if probing:
+            self._probing = False
+        if ok is None:
+            return
+        failed = not ok or latency > self.slow_call_seconds
+        if ok:
+            self.successes += 1
+            self._latencies.append(latency)
+            self._update_timeout()
+        else:
+            self.failures += 1
+
+        if probing:
+            if failed:
+                self._cooldown = min(self.max_open_seconds, self._cooldown * 2)
+                self._set_state(OPEN, "半开探测失败")
+            else:
+                self._cooldown = self.open_seconds
+                self._outcomes.clear()
+                self._set_state(CLOSED, f"半开探测成功（{latency:.1f} 秒）")
+            return
+        if self.state != CLOSED:
+            return  # 打开前已发出的请求，结果不再影响状态
+
+        self._outcomes.append(failed)
+        if len(self._outcomes) >= self.min_samples:
+            rate = sum(self._outcomes) / len(self._outcomes)
+            if rate >= self.failure_rate:
+                reason = f"最近 {len(self._outcomes)} 次调用中失败/慢调用比例 {rate:.0%}"
+                self._outcomes.clear()
+                self._set_state(OPEN, reason)
+
+    def _update_timeout(self):
+        if len(self._latencies) < self.min_samples:
+            return
+        p95 = self.p95_latency()
+        self._timeout = min(self.max_timeout, max(self.min_timeout, p95 * self.timeout_multiplier))
+
+    def p95_latency(self) -> float:
+        if not self._latencies:
+            return 0.0
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "retry_in": self.retry_in(),
+            "timeout": self._timeout,
+            "p95_latency": self.p95_latency(),
+            "successes": self.successes,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "opened": self.transitions[OPEN],
+        }
@@ -0,0 +1,195 @@
+import asyncio
+import time
+import unicodedata
+
+from .sqlite_worker import SQLiteWorker
+
+
+def normalize(text: str) -> str:
+    """统一全角/半角与大小写，去掉空白"""
+    return "".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+def bigrams(text: str) -> set:
+    """字符二元组（中日韩文本没有空格分词，按字符切分即可支持任意子串查询）"""
+    text = normalize(text)
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class RecognitionHistory:
+    """本地识别历史（只追加）
+
+    每次识别记录时间、会话范围、模型、图片标识与前N个 (角色, 作品)。
+    角色与作品去重后存入 entities 表，并按字符二元组建立倒排索引；
+    sightings 表按 (角色, 会话范围, 记录ID) 组织，entity_counts 维护出现次数，
+    因此查询开销只与匹配到的角色数有关，与历史总行数无关。
+    写入先进入内存缓冲区，攒够 batch_size 条或每 flush_seconds 秒批量写入。
+    """
+
+    def __init__(self, db_path: str, batch_size: int = 100, flush_seconds: float = 5.0):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._pending = []  # (ts, scope, model, image_hash, [(角色, 作品)])
+        self._flush_task = None
+        self._flush_wakeup = None
+        self._sqlite = SQLiteWorker(db_path, self._setup_db, "shitu-history")
+        self.recorded = 0
+
+    @staticmethod
+    def _setup_db(db):
+        db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS records (
+                id INTEGER PRIMARY KEY, ts REAL NOT NULL, scope TEXT NOT NULL,
+                model TEXT NOT NULL, image_hash TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS entities (
+                id INTEGER PRIMARY KEY, character TEXT NOT NULL, work TEXT NOT NULL, UNIQUE (character, work)
+            );
+            CREATE TABLE IF NOT EXISTS grams (
+                gram TEXT NOT NULL, entity_id INTEGER NOT NULL, PRIMARY KEY (gram, entity_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS sightings (
+                entity_id INTEGER NOT NULL, scope TEXT NOT NULL, record_id INTEGER NOT NULL, rank INTEGER NOT NULL,
+                PRIMARY KEY (entity_id, scope, record_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS entity_counts (
+                entity_id INTEGER NOT NULL, scope TEXT NOT NULL, count INTEGER NOT NULL, last_ts REAL NOT NULL,
+                PRIMARY KEY (entity_id, scope)
+            ) WITHOUT ROWID;
+            """
+        )
+
+    @staticmethod
+    def _entity_id(db, character: str, work: str) -> int:
+        row = db.execute("SELECT id FROM entities WHERE character = ? AND work = ?", (character, work)).fetchone()
+        if row is not None:
+            return row[0]
+        entity_id = db.execute("INSERT INTO entities (character, work) VALUES (?, ?)", (character, work)).lastrowid
+        db.executemany(
+            "INSERT OR IGNORE INTO grams (gram, entity_id) VALUES (?, ?)",
+            [(gram, entity_id) for gram in bigrams(character) | bigrams(work)],
+        )
+        return entity_id
+
+    def _write(self, db, batch: list):
+        with db:
+            for ts, scope, model, image_hash, pairs in batch:
+                record_id = db.execute(
+                    "INSERT INTO records (ts, scope, model, image_hash) VALUES (?, ?, ?, ?)",
+                    (ts, scope, model, image_hash),
+                ).lastrowid
+                for rank, (character, work) in enumerate(pairs):
+                    entity_id = self._entity_id(db, character, work)
+                    db.execute(
+                        "INSERT OR IGNORE INTO sightings (entity_id, scope, record_id, rank) VALUES (?, ?, ?, ?)",
+                        (entity_id, scope, record_id, rank),
+                    )
+                    db.execute(
+                        "INSERT INTO entity_counts (entity_id, scope, count, last_ts) VALUES (?, ?, 1, ?) "
+                        "ON CONFLICT (entity_id, scope) DO UPDATE SET count = count + 1, last_ts = excluded.last_ts",
+                        (entity_id, scope, ts),
+                    )
+
+    @staticmethod
+    def _match_entities(db, keyword: str, limit: int) -> list:
+        """按倒排索引查找名称包含关键词的角色/作品，返回 [(id, 角色, 作品)]"""
+        grams = bigrams(keyword)
+        if grams:
+            candidates = None
+            # 先查最少见的二元组，候选集迅速缩小
+            for gram in sorted(grams, key=lambda g: db.execute(
+                "SELECT COUNT(*) FROM (SELECT 1 FROM grams WHERE gram = ? LIMIT 1000)", (g,)
+            ).fetchone()[0]):
+                ids = {row[0] for row in db.execute("SELECT entity_id FROM grams WHERE gram = ?", (gram,))}
+                candidates = ids if candidates is None else candidates & ids
+                if not candidates:
+                    return []
+            rows = []
+            needle = normalize(keyword)
+            for entity_id in sorted(candidates):
+                character, work = db.execute(
+                    "SELECT character, work FROM entities WHERE id = ?", (entity_id,)
+                ).fetchone()
+                # 二元组都命中不代表连续出现，再确认一次子串
+                if needle in normalize(character) or needle in normalize(work):
+                    rows.append((entity_id, character, work))
+            return rows[:limit]
+        # 单个字符无法用二元组索引，直接扫描去重后的角色表（规模远小于历史记录）
+        pattern = f"%{keyword.strip()}%"
+        return db.execute(
+            "SELECT id, character, work FROM entities WHERE character LIKE ? OR work LIKE ? LIMIT ?",
+            (pattern, pattern, limit),
+        ).fetchall()
+
+    def _search(self, db, scope: str, keyword: str, limit: int, max_entities: int) -> list:
+        results = []
+        # 先按名称匹配（范围不限），再筛出本会话出现过的，避免其他会话的角色占满名额
+        for entity_id, character, work in self._match_entities(db, keyword, max_entities * 50):
+            if len(results) >= max_entities:
+                break
+            count_row = db.execute(
+                "SELECT count FROM entity_counts WHERE entity_id = ? AND scope = ?", (entity_id, scope)
+            ).fetchone()
+            if count_row is None:
+                continue
+            recent = db.execute(
+                "SELECT r.ts, r.model FROM sightings s JOIN records r ON r.id = s.record_id "
+                "WHERE s.entity_id = ? AND s.scope = ? ORDER BY s.record_id DESC LIMIT ?",
+                (entity_id, scope, limit),
+            ).fetchall()
+            results.append({"character": character, "work": work, "count": count_row[0], "recent": recent})
+        results.sort(key=lambda item: (-item["recent"][0][0] if item["recent"] else 0))
+        return results
+
+    def record(self, scope: str, model: str, image_hash: str, pairs):
+        """记录一次识别（写入缓冲区，稍后批量落盘）"""
+        if not pairs:
+            return
+        self._pending.append((time.time(), scope, model, image_hash, list(pairs)))
+        self.recorded += 1
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_wakeup = asyncio.Event()
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+        if len(self._pending) >= self.batch_size:
+            self._flush_wakeup.set()
+
+    async def _flush_loop(self):
+        """后台落盘：每 flush_seconds 秒或缓冲区攒满时写入一次，缓冲区清空后退出
+
+        写入过程中新攒满的记录在本轮写完后接着写，不会取消正在进行的写入。
+        """
+        while self._pending:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending or self._sqlite is None:
+            return
+        batch, self._pending = self._pending, []
+        # shield：调用方被取消时这批记录仍会写入（工作线程按提交顺序执行）
+        await asyncio.shield(self._sqlite.run(self._write, batch))
+
+    async def search(self, scope: str, keyword: str, limit: int = 5, max_entities: int = 10) -> list:
+        """查询本会话中名称包含关键词的角色，返回 [{character, work, count, recent: [(ts, model)]}]"""
+        await self.flush()
+        return await self._sqlite.run(self._search, scope, keyword, limit, max_entities)
+
+    def stats(self) -> dict:
+        return {"recorded": self.recorded, "pending": len(self._pending)}
+
+    def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._sqlite is not None:
+            batch, self._pending = self._pending, []
+            if batch:
+                self._sqlite.run_sync(self._write, batch)
+            self._sqlite.close()
+            self._sqlite = None
@@ -0,0 +1,185 @@
+import asyncio
+import base64
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+from .phash import dhash
+from .scheduler import QueueFullError
+
+
+DEFAULT_MAX_SIZE = 1024
+DEFAULT_QUALITY = 85
+MIN_QUALITY = 50
+QUALITY_STEP = 10
+
+_pil_image = None
+
+
+def _pil():
+    """首次解码图片时才导入PIL，加载插件时不需要它"""
+    global _pil_image
+    if _pil_image is None:
+        from PIL import Image
+
+        _pil_image = Image
+    return _pil_image
+
+
+def _flatten(img):
+    """把带透明通道的图片合成到白色背景上（JPEG不支持透明通道）"""
+    if img.mode not in ("RGBA", "LA"):
+        return img
+    rgba = img.convert("RGBA")
+    background = _pil().new("RGB", rgba.size, (255, 255, 255))
+    background.paste(rgba, mask=rgba.getchannel("A"))
+    return background
+
+
+def load_image(img_data: bytes, max_size: int = DEFAULT_MAX_SIZE, timings: dict = None):
+    """解码图片并缩放到最长边不超过max_size，返回RGB或L模式的图片"""
+    start = time.perf_counter()
+    img = _pil().open(BytesIO(img_data))
+    if getattr(img, "is_animated", False):
+        img.seek(0)  # 动图只取第一帧
+
+    scale = max_size / max(img.size)
+    if scale < 1 and img.format == "JPEG":
+        # JPEG可在解码时直接按1/2、1/4、1/8缩小，省去大部分解码开销
+        img.draft(img.mode, (int(img.size[0] * scale), int(img.size[1] * scale)))
+
+    if img.mode not in ("RGB", "L", "RGBA", "LA"):
+        # P/CMYK等模式先转换；调色板模式直接缩放只能用最近邻插值
+        has_alpha = img.mode in ("P", "PA") and ("transparency" in img.info or img.mode == "PA")
+        img = img.convert("RGBA" if has_alpha else "RGB")
+    img.load()
+    decoded = time.perf_counter()
+
+    if max(img.size) > max_size:
+        # reducing_gap：先用reduce()整数倍缩小，再用LANCZOS精确缩放
+        img.thumbnail((max_size, max_size), _pil().LANCZOS, reducing_gap=3.0)
+    img = _flatten(img)
+    if timings is not None:
+        timings["decode"] = decoded - start
+        timings["resize"] = time.perf_counter() - decoded
+    return img
+
+
+def encode_jpeg(img, quality: int = DEFAULT_QUALITY, max_bytes: int = 0, timings: dict = None) -> bytes:
+    """编码为JPEG；超出max_bytes时逐步降低质量，仍然超出则继续缩小尺寸"""
+    start = time.perf_counter()
+    while True:
+        for q in range(quality, MIN_QUALITY - 1, -QUALITY_STEP):
+            buffered = BytesIO()
+            img.save(buffered, format="JPEG", quality=q)
+            data = buffered.getvalue()
+            if max_bytes <= 0 or len(data) <= max_bytes:
+                break
+        if max_bytes <= 0 or len(data) <= max_bytes or max(img.size) <= 256:
+            break
+        img = img.resize((int(img.size[0] * 0.75), int(img.size[1] * 0.75)), _pil().LANCZOS)
+    if timings is not None:
+        timings["encode"] = time.perf_counter() - start
+    return data
+
+
+def _hash_jpeg_passthrough(img_data: bytes) -> int:
+    """直接复用原JPEG时，以最低解码比例计算感知哈希"""
+    img = _pil().open(BytesIO(img_data))
+    img.draft("L", (72, 64))
+    return dhash(img)
+
+
+def _can_passthrough(img, img_data: bytes, max_size: int, max_bytes: int) -> bool:
+    """源图已是尺寸和体积都符合要求的JPEG时无需重新编码"""
+    return (
+        img.format == "JPEG"
+        and img.mode in ("RGB", "L")
+        and max(img.size) <= max_size
+        and (max_bytes <= 0 or len(img_data) <= max_bytes)
+    )
+
+
+def preprocess_image(
+    img_data: bytes,
+    with_hash: bool = True,
+    max_size: int = DEFAULT_MAX_SIZE,
+    quality: int = DEFAULT_QUALITY,
+    max_bytes: int = 0,
+    as_base64: bool = True,
+):
+    """完整的预处理流程（在工作线程/进程中执行）
+
+    返回 (JPEG数据（as_base64时为base64字符串）, 感知哈希或None, 各阶段耗时)
+    """
+    timings = {}
+    start = time.perf_counter()
+    if _can_passthrough(_pil().open(BytesIO(img_data)), img_data, max_size, max_bytes):
+        image_hash = _hash_jpeg_passthrough(img_data) if with_hash else None
+        timings["decode"] = time.perf_counter() - start
+        jpeg_data = img_data
+    else:
+        img = load_image(img_data, max_size, timings)
+        image_hash = None
+        if with_hash:
+            hash_start = time.perf_counter()
+            image_hash = dhash(img)
+            timings["hash"] = time.perf_counter() - hash_start
+        jpeg_data = encode_jpeg(img, quality, max_bytes, timings)
+    if as_base64:
+        return base64.b64encode(jpeg_data).decode("utf-8"), image_hash, timings
+    return jpeg_data, image_hash, timings
+
+
+class ImageWorkerPool:
+    """图片预处理工作池：把解码、缩放、编码等CPU密集操作移出事件循环
+
+    同时提交的任务数超过 workers + max_queue 时直接拒绝，避免积压。
+    """
+
+    def __init__(self, mode: str = "thread", workers: int = 2, max_queue: int = 8):
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.limit = self.workers + max(0, max_queue)
+        self._pending = 0
+        self._executor = None
+        self.stage_stats = {}  # 阶段 -> [次数, 总耗时, 最大耗时]
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="shitu-image")
+        return self._executor
+
+    async def run(self, func, *args):
+        if self._pending >= self.limit:
+            raise QueueFullError("图片处理队列已满")
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self._pending -= 1
+
+    def record(self, timings: dict):
+        for stage, seconds in timings.items():
+            stats = self.stage_stats.get(stage)
+            if stats is None:
+                stats = self.stage_stats[stage] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def stats(self) -> dict:
+        result = {"mode": self.mode, "workers": self.workers, "pending": self._pending}
+        for stage, (count, total, peak) in self.stage_stats.items():
+            result[f"{stage}_avg_ms"] = total / count * 1000
+            result[f"{stage}_max_ms"] = peak * 1000
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -1,13 +1,73 @@
-from astrbot.api.event import filter, AstrMessageEvent
+import time
+
+_import_started = time.perf_counter()  # 统计插件模块导入耗时
+
+from astrbot.api.event import filter, AstrMessageEvent, MessageChain
 from astrbot.api.star import Context, Star, register
 from astrbot.api import logger
 from astrbot.api.message_components import Image as MsgImage, Reply
 import aiohttp
 import asyncio
 import base64
+import json
+import logging
+import os
 import re
-from io import BytesIO
-from PIL import Image as PILImage
+
+from .avatar_cache import AvatarCache, AvatarEntry
+from .breaker import CircuitBreaker, CircuitOpenError
+from .history import RecognitionHistory
+from .imaging import ImageWorkerPool, preprocess_image
+from .metrics import Metrics, write_text_atomic
+from .path_stats import PathSelector, image_host
+from .phash import HammingIndex, is_distinctive
+from .prefetch import Prefetcher
+from .reply_table import ReplyTable
+from .result_cache import ResultCache, content_digest
+from .scheduler import QueueFullError, RequestScheduler, current_requester, parse_retry_after
+from .sessions import WaitingSessionStore
+from .shared_state import SharedState
+from .singleflight import SingleFlight
+from .snapshot import dump_snapshot, load_snapshot
+
+PLUGIN_DATA_DIR = os.path.join("data", "astrbot_plugin_shitu")
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+# on_message 会处理每一条消息，头像识别命令用一个预编译正则一次匹配
+AVATAR_COMMAND_PATTERN = re.compile(r"头像(动漫|gal)?识别")
+AVATAR_COMMAND_MODELS = {
+    "动漫": "pre_stable",
+    "gal": "full_game_model_kira",
+    None: "animetrace_high_beta",
+}
+MANUAL_QQ_PATTERN = re.compile(r"头像(?:动漫|gal)?识别\s*(\d{5,12})")
+IMAGE_URL_PATTERN = re.compile(r"https?://[^\s\`\']+")
+
+
+# 多模型综合识别使用的伪模型名，以及默认参与综合识别的模型
+FANOUT_MODEL = "all"
+ALL_MODELS = ("pre_stable", "full_game_model_kira", "animetrace_high_beta")
+MODEL_NAMES = {
+    "pre_stable": "动漫识别",
+    "full_game_model_kira": "GalGame识别",
+    "animetrace_high_beta": "通用识别",
+}
+MODEL_EMOJIS = {
+    "pre_stable": "🎌",
+    "full_game_model_kira": "🎮",
+    "animetrace_high_beta": "🔍",
+}
+
+
+def get_message_text(messages) -> str:
+    """拼接消息链中的文本内容"""
+    parts = []
+    for msg in messages:
+        if hasattr(msg, "text"):
+            parts.append(str(msg.text))
+        elif getattr(msg, "type", None) == "Plain":
+            parts.append(str(msg))
+    return "".join(parts)
 
 
 @register("astrbot_plugin_shitu", "aurora", "动漫/Gal/二游图片识别插件", "3.5", "https://github.com/Aurora-xk/astrbot_plugin_shitu")
@@ -15,8 +75,6 @@ class AnimeTracePlugin(Star):
     def __init__(self, context: Context, config=None):
         super().__init__(context)
         self.api_url = "https://api.animetrace.com/v1/search"
-        self.waiting_sessions = {}  # 简单的会话管理
-        self.timeout_tasks = {}  # 存储超时任务
         
         # 加载配置
         if config:
@@ -28,6 +86,12 @@ class AnimeTracePlugin(Star):
         self.prompt_send_image = shitu_config.get("prompt_send_image", "📷 请发送要识别的图片（30秒内有效）")
         self.prompt_timeout = shitu_config.get("prompt_timeout", "⏰ 识别请求已超时，请重新发送命令")
         self.use_markdown = shitu_config.get("use_markdown", True)
+        # 等待发送图片的会话：按 (平台, 群组, 用户) 区分，统一由一个后台任务处理超时
+        self.waiting_sessions = WaitingSessionStore(
+            self.timeout_seconds,
+            max_sessions=shitu_config.get("max_waiting_sessions", 1000),
+            on_expire=self.on_session_timeout,
+        )
     # 新增：识别结果交给 LLM 的开关
         self.handoff_to_llm = shitu_config.get("handoff_to_llm", False)
         # 新增：是否一并传入图片（多模态）
@@ -37,9 +101,252 @@ class AnimeTracePlugin(Star):
             "llm_intro_message",
             "用户向你发来了一张图片，请根据下述识别结果，用通俗中文总结并给出相关信息补充和提醒。",
         )
+        # 渐进式交接：先立即发送识别结果，LLM 在预算内完成时再补充回复
+        self.handoff_progressive = shitu_config.get("handoff_progressive", False)
+        self.llm_budget_seconds = shitu_config.get("llm_budget_seconds", 30)
+        # 相同结果集（前5个角色）复用已格式化的回复与 LLM 总结
+        self.reply_table = ReplyTable(max_entries=512)
+        llm_summary_cache_ttl = shitu_config.get("llm_summary_cache_ttl", 3600)
+        self.llm_summaries = ReplyTable(max_entries=1024, ttl_seconds=llm_summary_cache_ttl) if llm_summary_cache_ttl > 0 else None
+        # 按 unified_msg_origin 缓存当前对话，LLM 回复后失效
+        self.conversation_cache_ttl = shitu_config.get("conversation_cache_ttl", 300)
+        self.conversation_cache = {}  # unified_msg_origin -> (过期时间, Conversation)
+
+        # 网络连接池配置（所有 AnimeTrace 调用与图片下载共用一个会话）
+        self.http_limit = shitu_config.get("http_limit", 100)
+        self.http_limit_per_host = shitu_config.get("http_limit_per_host", 10)
+        self.http_keepalive_timeout = shitu_config.get("http_keepalive_timeout", 30)
+        self.http_dns_cache_ttl = shitu_config.get("http_dns_cache_ttl", 300)
+        self.http_connect_timeout = shitu_config.get("http_connect_timeout", 10)
+        self.http_read_timeout = shitu_config.get("http_read_timeout", 30)
+        self.http_session = None
+
+        # 识别结果缓存（内存LRU + 可选SQLite持久层）
+        self.cache_enabled = shitu_config.get("cache_enabled", True)
+        self.cache_max_entries = shitu_config.get("cache_max_entries", 2048)
+        self.cache_ttl_seconds = shitu_config.get("cache_ttl_seconds", 7 * 24 * 3600)
+        self.cache_persistent = shitu_config.get("cache_persistent", True)
+        self.result_cache = None
+
+        # 感知哈希近似重复查找（应对QQ/Telegram重新压缩、缩放、轻微裁剪的图片）
+        self.phash_enabled = shitu_config.get("phash_enabled", True)
+        self.phash_max_distance = shitu_config.get("phash_max_distance", 6)
+        self.phash_max_entries = shitu_config.get("phash_max_entries", 200000)
+        self.phash_indexes = {}  # model -> HammingIndex
+
+        # URL方式与base64方式竞速：下载预处理与URL调用同时开始，延迟后发出base64请求
+        self.hedge_delay_seconds = shitu_config.get("hedge_delay_seconds", 3.0)
+        self.path_selector = PathSelector(
+            min_samples=shitu_config.get("url_skip_min_samples", 10),
+            min_success_rate=shitu_config.get("url_skip_success_rate", 0.2),
+        )
+        # URL方式胜出后继续在后台完成的下载任务（用URL结果补全内容缓存与近似重复索引）
+        self.background_tasks = set()
+
+        # 合并相同图片的并发识别请求（按模型+URL、模型+图片内容哈希）
+        self.inflight = SingleFlight()
+
+        # AnimeTrace 请求调度：并发上限、令牌桶限速、按群组/用户公平排队、过载拒绝
+        self.scheduler = RequestScheduler(
+            max_in_flight=shitu_config.get("scheduler_max_in_flight", 4),
+            rate_per_second=shitu_config.get("scheduler_rate_per_second", 2.0),
+            burst=shitu_config.get("scheduler_burst", 5),
+            max_queue=shitu_config.get("scheduler_max_queue", 50),
+            max_queue_per_user=shitu_config.get("scheduler_max_queue_per_user", 3),
+        )
+        self.prompt_queue_full = shitu_config.get("prompt_queue_full", "⏳ 当前识别请求过多，请稍后再试")
+
+        # AnimeTrace 熔断器：错误率或慢调用比例过高时暂停调用并直接回复降级提示；超时按p95耗时自适应
+        self.breaker = CircuitBreaker(
+            failure_rate=shitu_config.get("circuit_failure_rate", 0.5),
+            min_samples=shitu_config.get("circuit_min_samples", 10),
+            open_seconds=shitu_config.get("circuit_open_seconds", 30),
+            slow_call_seconds=shitu_config.get("circuit_slow_call_seconds", 10),
+            min_timeout=shitu_config.get("api_min_timeout", 5),
+            max_timeout=self.http_read_timeout,
+            timeout_multiplier=shitu_config.get("api_timeout_multiplier", 3.0),
+            on_state_change=self.on_breaker_state_change,
+        )
+        self.prompt_service_degraded = shitu_config.get(
+            "prompt_service_degraded", "🚧 识别服务当前不稳定，已暂停调用，请{retry_in}秒后再试"
+        )
+
+        # 图片预处理工作池（解码/缩放/编码不在事件循环中执行）
+        self.image_max_size = shitu_config.get("image_max_size", 1024)
+        self.image_quality = shitu_config.get("image_quality", 85)
+        self.image_max_bytes = shitu_config.get("image_max_bytes", 512 * 1024)
+        # 多模型综合识别参与的模型
+        self.fanout_models = [m for m in shitu_config.get("fanout_models", list(ALL_MODELS)) if m] or list(ALL_MODELS)
+
+        # 批量识别：一条消息（含引用消息）中有多张图片时逐张识别并分段回复
+        self.batch_enabled = shitu_config.get("batch_enabled", True)
+        self.batch_max_images = shitu_config.get("batch_max_images", 9)
+        self.batch_concurrency = shitu_config.get("batch_concurrency", 3)
+        self.batch_time_budget_seconds = shitu_config.get("batch_time_budget_seconds", 90)
+        self.batch_reply_chunk = shitu_config.get("batch_reply_chunk", 3)
+
+        # 预取：白名单群中出现的图片在接口空闲时提前识别，之后引用该图片识别可直接命中缓存
+        self.prefetch_groups = {str(g) for g in shitu_config.get("prefetch_groups", []) if g}
+        self.prefetch_models = [m for m in shitu_config.get("prefetch_models", ["animetrace_high_beta"]) if m]
+        self.prefetcher = Prefetcher(
+            self.prefetch_image,
+            ready=lambda: self.scheduler.has_spare_capacity() and not self.breaker.is_open(),
+            max_queue=shitu_config.get("prefetch_max_queue", 50),
+            group_budget=shitu_config.get("prefetch_group_budget", 30),
+        )
+
+        # 多进程共享状态：同一主机上的多个 AstrBot 进程共用识别结果、去重租约与上游速率预算
+        self.shared_state_path = shitu_config.get("shared_state_path", "")
+        self.shared_rate_per_second = shitu_config.get("shared_rate_per_second", 2.0)
+        self.shared_burst = shitu_config.get("shared_burst", 5)
+        self.shared_state = None
+        self.shared_dedupe = False
+
+        # 识别历史：本地只追加记录每次识别的前N个结果，识图历史命令离线查询
+        self.history_enabled = shitu_config.get("history_enabled", True)
+        self.history_top_n = shitu_config.get("history_top_n", 5)
+        self.history_batch_size = shitu_config.get("history_batch_size", 100)
+        self.history_flush_seconds = shitu_config.get("history_flush_seconds", 5)
+        self.history = None
+
+        # 头像识别缓存：按QQ号记录头像新鲜度与各模型结果
+        self.avatar_cache = AvatarCache(
+            ttl_seconds=shitu_config.get("avatar_cache_ttl_seconds", 600),
+            max_entries=shitu_config.get("avatar_cache_max_entries", 2000),
+        )
+
+        # 上传方式：multipart 直接上传JPEG文件，base64 为兼容旧方式的表单字段
+        self.upload_mode = shitu_config.get("upload_mode", "multipart")
+        self.download_max_bytes = shitu_config.get("download_max_bytes", 20 * 1024 * 1024)
+        self.download_timeout = shitu_config.get("download_timeout", 30)
+        self.image_pool = ImageWorkerPool(
+            mode=shitu_config.get("image_pool_mode", "thread"),
+            workers=shitu_config.get("image_pool_workers", 2),
+            max_queue=shitu_config.get("image_pool_max_queue", 8),
+        )
+
+        # 各阶段耗时与计数统计（识图状态命令 / 可选的 Prometheus 文本导出）
+        self.metrics = Metrics(enabled=shitu_config.get("metrics_enabled", True))
+        self.metrics_export_path = shitu_config.get("metrics_export_path", "")
+        self.metrics_export_interval = shitu_config.get("metrics_export_interval", 60)
+        self.metrics_export_task = None
+
+        # 热状态快照：卸载时保存近期识别结果、头像新鲜度与识别方式统计，重新加载时恢复
+        self.snapshot_enabled = shitu_config.get("snapshot_enabled", True)
+        self.snapshot_path = os.path.join(PLUGIN_DATA_DIR, "warm_state.bin")
+        self.startup = {"import_ms": IMPORT_SECONDS * 1000, "initialize_ms": 0.0, "restored": 0}
 
     async def initialize(self):
-        logger.info("动漫/Gal/二游识别插件已加载")
+        started = time.perf_counter()
+        await self.get_http_session()
+        if self.cache_enabled:
+            db_path = os.path.join(PLUGIN_DATA_DIR, "result_cache.db") if self.cache_persistent else None
+            if self.shared_state_path:
+                db_path = self.shared_state_path  # 识别结果与共享状态存放在同一个数据库文件
+            try:
+                self.result_cache = ResultCache(self.cache_max_entries, self.cache_ttl_seconds, db_path)
+            except Exception as e:
+                logger.warning(f"持久化缓存初始化失败，仅使用内存缓存: {e}")
+                self.result_cache = ResultCache(self.cache_max_entries, self.cache_ttl_seconds)
+        if self.shared_state_path:
+            await self.init_shared_state()
+        if self.history_enabled:
+            try:
+                self.history = RecognitionHistory(
+                    os.path.join(PLUGIN_DATA_DIR, "history.db"),
+                    batch_size=self.history_batch_size,
+                    flush_seconds=self.history_flush_seconds,
+                )
+            except Exception as e:
+                logger.warning(f"识别历史初始化失败，已停用: {e}")
+        if self.prefetch_groups and self.result_cache is None:
+            logger.warning("预取需要启用识别结果缓存（cache_enabled），已停用预取")
+            self.prefetch_groups = set()
+        if self.metrics.enabled and self.metrics_export_path:
+            self.metrics_export_task = asyncio.create_task(self.export_metrics_loop())
+        if self.snapshot_enabled:
+            try:
+                self.startup["restored"] = await self.restore_snapshot()
+            except Exception as e:
+                logger.warning(f"恢复热状态快照失败: {e}")
+        self.startup["initialize_ms"] = (time.perf_counter() - started) * 1000
+        logger.info(
+            f"动漫/Gal/二游识别插件已加载（导入 {self.startup['import_ms']:.0f}ms，"
+            f"初始化 {self.startup['initialize_ms']:.0f}ms，从快照恢复 {self.startup['restored']} 条）"
+        )
+
+    async def init_shared_state(self):
+        """打开多进程共享状态：全局令牌桶始终生效，跨进程去重需要共享的结果缓存"""
+        try:
+            self.shared_state = SharedState(self.shared_state_path)
+        except Exception as e:
+            logger.warning(f"共享状态初始化失败，各进程将独立运行: {e}")
+            return
+        if self.shared_rate_per_second > 0:
+            shared_state = self.shared_state
+            rate, burst = self.shared_rate_per_second, self.shared_burst
+            self.scheduler.global_limiter = lambda: shared_state.acquire_token("animetrace", rate, burst)
+        self.shared_dedupe = self.result_cache is not None and self.result_cache.db_path == self.shared_state_path
+        if not self.shared_dedupe:
+            logger.warning("识别结果缓存未使用共享数据库（cache_enabled 已关闭或打开失败），进程间不会共享识别结果")
+        logger.info(f"已启用多进程共享状态: {self.shared_state_path}")
+
+    def build_snapshot(self) -> dict:
+        """收集需要跨重启保留的热状态"""
+        state = {
+            "paths": self.path_selector.snapshot(),
+            "avatars": self.avatar_cache.snapshot(),
+        }
+        if self.result_cache is not None:
+            state["results"] = self.result_cache.snapshot()
+        if self.phash_enabled:
+            # 感知哈希索引可能很大，只保留每个模型最近的条目
+            state["phash"] = {
+                model: index.items()[-self.cache_max_entries:] for model, index in self.phash_indexes.items()
+            }
+        return state
+
+    async def save_snapshot(self):
+        state = self.build_snapshot()
+        size = await asyncio.to_thread(dump_snapshot, self.snapshot_path, state)
+        logger.debug(f"已保存热状态快照: {size} 字节")
+
+    async def restore_snapshot(self) -> int:
+        """从快照恢复热状态，返回恢复的条目数"""
+        state = await asyncio.to_thread(load_snapshot, self.snapshot_path)
+        if not state:
+            return 0
+        restored = self.path_selector.restore(state.get("paths", {}))
+        restored += self.avatar_cache.restore(state.get("avatars", []))
+        if self.result_cache is not None:
+            restored += self.result_cache.restore(state.get("results", []))
+        if self.phash_enabled:
+            for model, items in state.get("phash", {}).items():
+                for image_hash, results in items:
+                    self.remember_image_hash(model, image_hash, results)
+                restored += len(items)
+        return restored
+
+    async def get_http_session(self) -> aiohttp.ClientSession:
+        """获取共享的HTTP会话（不存在或已关闭时重新创建）"""
+        if self.http_session is None or self.http_session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.http_limit,
+                limit_per_host=self.http_limit_per_host,
+                keepalive_timeout=self.http_keepalive_timeout,
+                ttl_dns_cache=self.http_dns_cache_ttl,
+                use_dns_cache=True,
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=None,
+                connect=self.http_connect_timeout,
+                sock_read=self.http_read_timeout,
+            )
+            self.http_session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            logger.debug(
+                f"已创建共享HTTP会话: limit={self.http_limit}, limit_per_host={self.http_limit_per_host}"
+            )
+        return self.http_session
 
     @filter.command("动漫识别", "动漫图片识别")
     async def anime_search(self, event: AstrMessageEvent, args=None):
@@ -59,6 +366,12 @@ class AnimeTracePlugin(Star):
         async for res in self.handle_image_recognition(event, "animetrace_high_beta"):
             yield res
 
+    @filter.command("全部识别")
+    async def all_models_search(self, event: AstrMessageEvent, args=None):
+        """同时使用三个模型识别同一张图片，按模型间一致程度综合排序"""
+        async for res in self.handle_image_recognition(event, FANOUT_MODEL):
+            yield res
+
     @filter.command("头像动漫识别")
     async def avatar_anime_search(self, event: AstrMessageEvent, args=None):
         """识别QQ用户头像（动漫模型）"""
@@ -77,11 +390,41 @@ class AnimeTracePlugin(Star):
         async for res in self.handle_avatar_recognition(event, "animetrace_high_beta"):
             yield res
 
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("识图状态")
+    async def status_command(self, event: AstrMessageEvent, args=None):
+        """查看识别各阶段耗时、回退情况、错误分布与缓存/队列状态（仅管理员）"""
+        await event.send(event.plain_result(self.format_status()))
+
+    @filter.command("识图历史")
+    async def history_command(self, event: AstrMessageEvent, args=None):
+        """查询本群识别过的角色（只查本地记录，不调用识别接口）"""
+        if self.history is None:
+            await event.send(event.plain_result("📜 未启用识别历史"))
+            return
+        keyword = get_message_text(event.get_messages()).strip()
+        keyword = re.sub(r"^\W*识图历史", "", keyword).strip()
+        if not keyword:
+            await event.send(event.plain_result("📜 用法: 识图历史 <角色名或作品名>"))
+            return
+        try:
+            matches = await self.history.search(self.history_scope(*self.get_requester(event)), keyword)
+        except Exception as e:
+            logger.error(f"查询识别历史失败: {e}")
+            await event.send(event.plain_result("❌ 查询识别历史失败"))
+            return
+        await event.send(event.plain_result(self.format_history(keyword, matches)))
+
     async def handle_image_recognition(self, event: AstrMessageEvent, model: str):
         """简化的图片识别处理（透传下游 async generator）"""
         user_id = event.get_sender_id()
 
         # 检查当前消息是否包含图片（包括引用消息中的图片）
+        if self.batch_enabled:
+            image_urls = self.extract_images_from_event(event, limit=self.batch_max_images + 1)
+            if len(image_urls) > 1:
+                await self.process_batch_recognition(event, image_urls, model)
+                return
         image_url = await self.extract_image_from_event(event)
         if image_url:
             # 如果找到图片，直接进行识别并透传结果
@@ -99,19 +442,8 @@ class AnimeTracePlugin(Star):
         except Exception as e:
             logger.warning(f"检查引用消息状态时出错: {str(e)}")
 
-        # 如果没有图片，设置等待状态
-        self.waiting_sessions[user_id] = {
-            "model": model,
-            "timestamp": asyncio.get_event_loop().time(),
-            "event": event,  # 保存事件对象用于超时消息发送
-        }
-
-        # 创建30秒超时任务
-        if user_id in self.timeout_tasks:
-            self.timeout_tasks[user_id].cancel()  # 取消之前的超时任务
-
-        timeout_task = asyncio.create_task(self.timeout_check(user_id))
-        self.timeout_tasks[user_id] = timeout_task
+        # 如果没有图片，设置等待状态（只保存超时提示所需的会话来源，不保存事件对象）
+        self.waiting_sessions.put(self.get_session_key(event), model, event.unified_msg_origin)
 
         await event.send(event.plain_result(self.prompt_send_image))
         logger.debug(f"用户 {user_id} 进入等待图片状态，等待{self.timeout_seconds}秒")
@@ -134,16 +466,8 @@ class AnimeTracePlugin(Star):
                 await event.send(event.plain_result("📸 识别您自己的头像..."))
             else:
                 # 检查是否是手动输入的QQ号（通过正则匹配确认）
-                messages = event.get_messages()
-                full_text = ""
-                for msg in messages:
-                    if hasattr(msg, "text"):
-                        full_text += str(msg.text)
-                    elif hasattr(msg, "type") and msg.type == "Plain":
-                        full_text += str(msg)
-
-                import re
-                qq_match = re.search(r"头像(?:动漫|gal)?识别\s*(\d{5,12})", full_text)
+                full_text = get_message_text(event.get_messages())
+                qq_match = MANUAL_QQ_PATTERN.search(full_text)
                 if qq_match and qq_match.group(1) == mentioned_user_id:
                     logger.debug(f"识别到手动输入的QQ号: {mentioned_user_id}")
                     await event.send(event.plain_result(f"📸 识别QQ号 {mentioned_user_id} 的头像..."))
@@ -155,8 +479,10 @@ class AnimeTracePlugin(Star):
             # 标记此事件已被处理，避免消息监听器重复处理
             event._avatar_command_processed = True
 
-            # 识别头像
-            async for res in self.process_image_recognition(event, avatar_url, model):
+            # 识别头像（头像URL固定不变，按QQ号缓存并用条件请求判断头像是否更换）
+            async for res in self.process_image_recognition(
+                event, avatar_url, model, lambda: self.recognize_avatar(mentioned_user_id, avatar_url, model)
+            ):
                 yield res
 
         except Exception as e:
@@ -166,100 +492,129 @@ class AnimeTracePlugin(Star):
     @filter.event_message_type(filter.EventMessageType.ALL)
     async def on_message(self, event: AstrMessageEvent):
         """监听所有消息，处理等待中的图片识别请求和特殊格式的头像识别命令"""
-        user_id = event.get_sender_id()
-
         # 检查特殊格式的头像识别命令（消息中包含@但命令可能被遗漏的情况）
         messages = event.get_messages()
-        full_text = ""
-
-        logger.debug(f"on_message收到消息，消息列表: {messages}")
-
-        for msg in messages:
-            logger.debug(f"处理消息组件: type={getattr(msg, 'type', '无type')}, text={getattr(msg, 'text', '无text')}")
-
-            if hasattr(msg, "text"):
-                full_text += str(msg.text)
-            elif hasattr(msg, "type") and msg.type == "Plain":
-                full_text += str(msg)
-
-        logger.debug(f"提取的完整文本: '{full_text}'")
+        full_text = get_message_text(messages)
 
         # 只有当标准命令处理器未处理时才检查
         if not hasattr(event, "_avatar_command_processed"):
-            avatar_patterns = [
-                (r"头像动漫识别", "pre_stable"),
-                (r"头像gal识别", "full_game_model_kira"),
-                (r"头像识别", "animetrace_high_beta"),
-            ]
-
-            for pattern, model in avatar_patterns:
-                if re.search(pattern, full_text):
-                    logger.debug(f"通过on_message检测到头像识别命令: {pattern}")
-                    # 标记为已处理，避免重复
-                    event._avatar_command_processed = True
-                    async for res in self.handle_avatar_recognition(event, model):
-                        yield res
-                    return  # 处理完后直接返回，避免重复处理
-
-        # 检查用户是否在等待图片识别
-        if user_id not in self.waiting_sessions:
+            avatar_match = AVATAR_COMMAND_PATTERN.search(full_text)
+            if avatar_match:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"通过on_message检测到头像识别命令: {avatar_match.group(0)}，消息列表: {messages}")
+                # 标记为已处理，避免重复
+                event._avatar_command_processed = True
+                async for res in self.handle_avatar_recognition(event, AVATAR_COMMAND_MODELS[avatar_match.group(1)]):
+                    yield res
+                return  # 处理完后直接返回，避免重复处理
+
+        if self.prefetch_groups:
+            self.offer_prefetch(event, messages)
+
+        # 没有任何等待中的会话时无需计算会话键
+        if not self.waiting_sessions:
             return
 
-        session = self.waiting_sessions[user_id]
-
-        # 检查是否超时
-        current_time = asyncio.get_event_loop().time()
-        if current_time - session["timestamp"] > self.timeout_seconds:
-            return  # 超时检查由定时任务处理，这里直接返回
+        # 检查用户是否在等待图片识别（已超时的会话视为不存在，由后台任务清理）
+        session_key = self.get_session_key(event)
+        if self.waiting_sessions.get(session_key) is None:
+            return
 
         # 提取图片
-        image_url = await self.extract_image_from_event(event)
-        if not image_url:
+        image_urls = self.extract_images_from_event(event, limit=self.batch_max_images + 1 if self.batch_enabled else 1)
+        if not image_urls:
             return  # 不是图片消息，继续等待
 
         # 找到图片，开始识别
-        del self.waiting_sessions[user_id]  # 清除等待状态
-        if user_id in self.timeout_tasks:
-            self.timeout_tasks[user_id].cancel()  # 取消超时任务
-            del self.timeout_tasks[user_id]
-        async for res in self.process_image_recognition(event, image_url, session["model"]):
+        session = self.waiting_sessions.pop(session_key)  # 清除等待状态
+        if session is None:
+            return
+        if len(image_urls) > 1:
+            await self.process_batch_recognition(event, image_urls, session.model)
+            return
+        image_url = image_urls[0]
+        async for res in self.process_image_recognition(event, image_url, session.model):
             yield res
 
+    def offer_prefetch(self, event: AstrMessageEvent, messages):
+        """白名单群的消息中有图片时加入预取队列（只看当前消息，不看引用消息）"""
+        try:
+            group_id = str(event.get_group_id() or "")
+        except Exception:
+            return
+        if group_id not in self.prefetch_groups:
+            return
+        for msg in messages:
+            if isinstance(msg, MsgImage):
+                image_url = self.get_image_url(msg)
+                if image_url and self.prefetcher.offer(group_id, image_url):
+                    logger.debug(f"群 {group_id} 的图片已加入预取队列")
+
+    async def prefetch_image(self, group_id: str, image_url: str):
+        """后台预取：用预取模型识别图片，结果写入识别结果缓存"""
+        requester_token = current_requester.set((group_id, "prefetch", False))
+        try:
+            for model in self.prefetch_models:
+                await self.inflight.do(("url", model, image_url), lambda m=model: self.recognize(image_url, m))
+                self.metrics.inc("prefetch", model)
+        finally:
+            current_requester.reset(requester_token)
+
     async def process_image_recognition(
-        self, event: AstrMessageEvent, image_url: str, model: str
+        self, event: AstrMessageEvent, image_url: str, model: str, recognizer=None
     ):
-        """处理图片识别"""
+        """处理图片识别（recognizer 为获取识别结果的协程工厂，默认按图片URL识别）"""
+        if recognizer is None:
+            if model == FANOUT_MODEL:
+                recognizer = lambda: self.recognize_all(image_url)  # noqa: E731
+            else:
+                recognizer = lambda: self.recognize(image_url, model)  # noqa: E731
+        metrics = self.metrics
+        started_at = time.monotonic()
         try:
-            # 首先尝试直接使用URL调用API（更高效）
-            results = await self.call_animetrace_api_with_url(image_url, model)
-
-            # 如果URL方式失败，再回退到下载图片方式
-            if not results or not results.get("data"):
-                logger.debug("URL识别方式未返回结果，尝试下载图片识别...")
-                img_data = await self.download_and_process_image(image_url)
-                results = await self.call_animetrace_api(img_data, model)
+            requester_token = current_requester.set((*self.get_requester(event), True))
+            try:
+                with metrics.timer("recognize", model):
+                    results = await self.inflight.do(("url", model, image_url), recognizer)
+            finally:
+                current_requester.reset(requester_token)
+            self.record_history(self.get_requester(event), model, image_url, results)
 
             # 格式化结果
-            response = self.format_results(results, model)
+            with metrics.timer("format", model):
+                if model == FANOUT_MODEL:
+                    response = self.format_merged_results(results)
+                else:
+                    response = self.format_results(results, model)
 
             # 分支：是否交给当前 LLM 处理（带人格）
             if self.handoff_to_llm:
+                handoff_start = time.perf_counter()
+                if self.handoff_progressive:
+                    # 先发送识别结果，再在剩余预算内等待 LLM 的补充回复
+                    try:
+                        await event.send(event.plain_result(response))
+                    except Exception as send_error:
+                        logger.warning(f"发送识别结果失败: {send_error}")
+                    await self.send_llm_followup(
+                        event, image_url, response, model, results, started_at + self.llm_budget_seconds
+                    )
+                    return
                 try:
                     # 获取/创建当前会话的 Conversation，以触发人设(Persona)注入
-                    conv_mgr = self.context.conversation_manager
-                    cid = await conv_mgr.get_curr_conversation_id(event.unified_msg_origin)
-                    if not cid:
-                        cid = await conv_mgr.new_conversation(event.unified_msg_origin)
-                    conversation = await conv_mgr.get_conversation(event.unified_msg_origin, cid)
-
-                    # 组织 LLM 提示词（前置可自定义引导语 + 识别结果）
-                    intro = self.llm_intro_message or "用户向你发来了一张图片，请根据下述识别结果，用通俗中文总结并给出相关信息补充和提醒。"
-                    prompt = f"{intro}\n\n{response}"
-                    # 多模态：根据配置决定是否把原图 URL 作为 image_urls 传入
-                    image_inputs = []
-                    if self.handoff_with_image and image_url and image_url.lower().startswith(("http://", "https://")):
-                        image_inputs = [image_url]
+                    conversation = await self.get_conversation(event.unified_msg_origin)
+                    summary_key = self.summary_key(model, results, self.get_persona_prompt(conversation))
+                    summary = self.llm_summaries.get(summary_key) if summary_key else None
+                    if summary is not None:
+                        # 相同结果集已有 LLM 总结，直接复用
+                        self.metrics.inc("llm_summary", "reused")
+                        await event.send(event.plain_result(summary))
+                        return
+                    event._shitu_summary_key = summary_key  # 在 on_llm_response 中保存本次总结
+
+                    prompt, image_inputs = self.build_llm_prompt(image_url, response)
                     func_tool_mgr = self.context.get_llm_tool_manager()
+                    metrics.observe("llm_handoff", model, "", time.perf_counter() - handoff_start)
                     yield event.request_llm(
                         prompt=prompt,
                         image_urls=image_inputs,
@@ -282,18 +637,9 @@ class AnimeTracePlugin(Star):
                 logger.warning(f"发送识别结果失败: {send_error}")
 
         except Exception as e:
-            error_msg = str(e)
-            logger.error(f"识别失败: {error_msg}")
-
-            # 更友好的错误提示
-            if "HTTP 500" in error_msg:
-                user_msg = "❌ 识别服务暂时不可用，请稍后重试"
-            elif "HTTP 422" in error_msg:
-                user_msg = "❌ 图片格式不支持，请尝试其他图片"
-            elif "timeout" in error_msg.lower():
-                user_msg = "❌ 识别超时，请稍后重试"
-            else:
-                user_msg = f"❌ 识别失败: {error_msg}"
+            logger.error(f"识别失败: {str(e)}")
+            metrics.inc("recognition_errors", type(e).__name__)
+            user_msg = self.friendly_error_message(e)
 
             try:
                 await event.send(event.plain_result(user_msg))
@@ -301,24 +647,612 @@ class AnimeTracePlugin(Star):
                 logger.warning(f"发送错误消息失败: {send_error}")
                 # 如果错误消息也发送失败，记录日志但不抛出异常
 
+    def build_llm_prompt(self, image_url: str, response: str) -> tuple:
+        """组织 LLM 提示词（前置可自定义引导语 + 识别结果）与多模态图片输入"""
+        intro = self.llm_intro_message or "用户向你发来了一张图片，请根据下述识别结果，用通俗中文总结并给出相关信息补充和提醒。"
+        prompt = f"{intro}\n\n{response}"
+        # 多模态：根据配置决定是否把原图 URL 作为 image_urls 传入
+        image_inputs = []
+        if self.handoff_with_image and image_url and image_url.lower().startswith(("http://", "https://")):
+            image_inputs = [image_url]
+        return prompt, image_inputs
+
+    async def get_conversation(self, unified_msg_origin: str):
+        """获取/创建当前会话的 Conversation（缓存 conversation_cache_ttl 秒，LLM 回复后失效）"""
+        now = time.monotonic()
+        cached = self.conversation_cache.get(unified_msg_origin)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        conv_mgr = self.context.conversation_manager
+        cid = await conv_mgr.get_curr_conversation_id(unified_msg_origin)
+        if not cid:
+            cid = await conv_mgr.new_conversation(unified_msg_origin)
+        conversation = await conv_mgr.get_conversation(unified_msg_origin, cid)
+        self.conversation_cache.pop(unified_msg_origin, None)
+        self.conversation_cache[unified_msg_origin] = (now + self.conversation_cache_ttl, conversation)
+        if len(self.conversation_cache) > 1000:
+            del self.conversation_cache[next(iter(self.conversation_cache))]
+        return conversation
+
+    def get_persona_prompt(self, conversation) -> str:
+        """查找对话使用的人格设定（未设置时使用默认人格）"""
+        persona_id = getattr(conversation, "persona_id", None)
+        if persona_id == "[%None]":
+            return ""  # 用户显式取消了人格
+        provider_manager = self.context.provider_manager
+        if not persona_id:
+            persona_id = (getattr(provider_manager, "selected_default_persona", None) or {}).get("name")
+        for persona in getattr(provider_manager, "personas", None) or []:
+            if persona.get("name") == persona_id:
+                return persona.get("prompt", "")
+        return ""
+
+    def summary_key(self, model: str, results, persona_prompt: str):
+        """LLM 总结的缓存键：(模型, 前5个(角色, 作品), 人格设定)，未启用或无结果时返回None"""
+        if self.llm_summaries is None:
+            return None
+        top = self.top_characters(results, model)
+        if not top:
+            return None
+        return model, top, persona_prompt
+
+    async def send_llm_followup(
+        self, event: AstrMessageEvent, image_url: str, response: str, model: str, results, deadline: float
+    ):
+        """渐进式交接的第二阶段：在截止时间前拿到 LLM 回复则补充发送，否则放弃"""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.debug("识别耗时已超出 LLM 预算，跳过补充回复")
+            self.metrics.inc("llm_followup", "skipped")
+            return
+        start = time.perf_counter()
+        try:
+            provider = self.context.get_using_provider()
+            if provider is None:
+                return
+            conversation = await self.get_conversation(event.unified_msg_origin)
+            persona_prompt = self.get_persona_prompt(conversation)
+            summary_key = self.summary_key(model, results, persona_prompt)
+            text = self.llm_summaries.get(summary_key) if summary_key else None
+            if text is not None:
+                self.metrics.inc("llm_summary", "reused")
+                await event.send(event.plain_result(text))
+                return
+            history = getattr(conversation, "history", None)
+            prompt, image_inputs = self.build_llm_prompt(image_url, response)
+            llm_response = await asyncio.wait_for(
+                provider.text_chat(
+                    prompt=prompt,
+                    image_urls=image_inputs,
+                    contexts=json.loads(history) if history else [],
+                    system_prompt=persona_prompt,
+                ),
+                timeout=deadline - time.monotonic(),
+            )
+        except asyncio.TimeoutError:
+            logger.info(f"LLM 未在 {self.llm_budget_seconds} 秒预算内完成，放弃补充回复")
+            self.metrics.inc("llm_followup", "dropped")
+            return
+        except Exception as e:
+            logger.error(f"LLM 补充回复失败: {e}")
+            self.metrics.inc("llm_followup", "failed")
+            return
+        self.metrics.observe("llm_followup", model, "", time.perf_counter() - start)
+        text = getattr(llm_response, "completion_text", None)
+        if not text:
+            return
+        if summary_key:
+            self.llm_summaries.put(summary_key, text)
+        self.metrics.inc("llm_followup", "sent")
+        try:
+            await event.send(event.plain_result(text))
+        except Exception as send_error:
+            logger.warning(f"发送 LLM 补充回复失败: {send_error}")
+
+    @filter.on_llm_response()
+    async def on_llm_response(self, event: AstrMessageEvent, resp):
+        """LLM 回复后对话历史已更新，使缓存的 Conversation 失效；识图交接的回复记为该结果集的总结"""
+        self.conversation_cache.pop(event.unified_msg_origin, None)
+        summary_key = getattr(event, "_shitu_summary_key", None)
+        text = getattr(resp, "completion_text", None)
+        if summary_key and text:
+            self.llm_summaries.put(summary_key, text)
+
+    def friendly_error_message(self, e: Exception) -> str:
+        """把识别过程中的异常转换为更友好的错误提示"""
+        error_msg = str(e)
+        if isinstance(e, QueueFullError):
+            return self.prompt_queue_full
+        if isinstance(e, CircuitOpenError):
+            return self.prompt_service_degraded.replace("{retry_in}", str(max(1, round(e.retry_in))))
+        if "HTTP 500" in error_msg:
+            return "❌ 识别服务暂时不可用，请稍后重试"
+        if "HTTP 422" in error_msg:
+            return "❌ 图片格式不支持，请尝试其他图片"
+        if "timeout" in error_msg.lower():
+            return "❌ 识别超时，请稍后重试"
+        return f"❌ 识别失败: {error_msg}"
+
+    async def process_batch_recognition(self, event: AstrMessageEvent, image_urls: list, model: str):
+        """批量识别多张图片：有限并发处理，每完成若干张就分段回复"""
+        if len(image_urls) > self.batch_max_images:
+            # 调用方最多只取 batch_max_images + 1 张，这里不知道实际总数
+            await event.send(
+                event.plain_result(f"📚 图片超过 {self.batch_max_images} 张，本次只识别前 {self.batch_max_images} 张")
+            )
+            image_urls = image_urls[: self.batch_max_images]
+
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+        requester = self.get_requester(event)
+
+        async def run(index: int, image_url: str):
+            async with semaphore:
+                recognizer = (
+                    (lambda: self.recognize_all(image_url))
+                    if model == FANOUT_MODEL
+                    else (lambda: self.recognize(image_url, model))
+                )
+                # 批量识别的并发已由信号量限制，不受单用户排队上限约束
+                requester_token = current_requester.set((*requester, False))
+                try:
+                    results = await self.inflight.do(("url", model, image_url), recognizer)
+                    self.record_history(requester, model, image_url, results)
+                    return index, results
+                except Exception as e:
+                    logger.error(f"第 {index + 1} 张图片识别失败: {str(e)}")
+                    return index, e
+                finally:
+                    current_requester.reset(requester_token)
+
+        tasks = [asyncio.ensure_future(run(i, url)) for i, url in enumerate(image_urls)]
+        pending_lines = []
+        finished = set()
+        try:
+            for next_done in asyncio.as_completed(tasks, timeout=self.batch_time_budget_seconds):
+                try:
+                    index, outcome = await next_done
+                except asyncio.TimeoutError:
+                    break
+                finished.add(index)
+                pending_lines.append(self.format_batch_item(index, outcome, model))
+                if len(pending_lines) >= self.batch_reply_chunk and len(finished) < len(tasks):
+                    await self.send_batch_lines(event, pending_lines)
+                    pending_lines = []
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        unfinished = [str(i + 1) for i in range(len(image_urls)) if i not in finished]
+        if unfinished:
+            pending_lines.append(
+                f"⏰ 第 {'、'.join(unfinished)} 张在 {self.batch_time_budget_seconds} 秒内未完成，请稍后单独识别"
+            )
+            logger.debug(f"批量识别超出时间预算，未完成: {len(unfinished)} 张")
+        if pending_lines:
+            await self.send_batch_lines(event, pending_lines)
+
+    async def send_batch_lines(self, event: AstrMessageEvent, lines: list):
+        try:
+            await event.send(event.plain_result("\n\n".join(lines)))
+        except Exception as send_error:
+            logger.warning(f"发送识别结果失败: {send_error}")
+
+    def format_batch_item(self, index: int, outcome, model: str) -> str:
+        """批量识别中单张图片的精简结果（前3项）"""
+        title = f"🖼️ 第{index + 1}张"
+        if isinstance(outcome, Exception):
+            return f"{title}: {self.friendly_error_message(outcome)}"
+        top = self.top_characters(outcome, model)
+        if not top:
+            return f"{title}: 🔍 未识别到具体角色信息"
+        if self.use_markdown:
+            items = [f"**{name}** - 《{work}》" for name, work in top[:3]]
+        else:
+            items = [f"{name} - 《{work}》" for name, work in top[:3]]
+        return f"{title}: " + " / ".join(items)
+
+    def get_session_key(self, event: AstrMessageEvent) -> tuple:
+        """等待会话的键：(平台, 群组ID, 用户ID)"""
+        try:
+            platform = event.get_platform_name() or ""
+        except Exception:
+            platform = ""
+        group_id, user_id = self.get_requester(event)
+        return platform, group_id, user_id
+
+    def get_requester(self, event: AstrMessageEvent) -> tuple:
+        """获取请求发起者 (群组ID, 用户ID)，私聊的群组ID为空"""
+        try:
+            group_id = event.get_group_id() or ""
+        except Exception:
+            group_id = ""
+        return str(group_id), str(event.get_sender_id())
+
+    def history_scope(self, group_id: str, user_id: str) -> str:
+        """识别历史的查询范围：群聊按群，私聊按用户"""
+        return f"group:{group_id}" if group_id else f"private:{user_id}"
+
+    def record_history(self, requester: tuple, model: str, image_url: str, results):
+        """把一次识别的前N个 (角色, 作品) 写入识别历史"""
+        if self.history is None:
+            return
+        try:
+            pairs = self.top_characters(results, model)[: self.history_top_n]
+            self.history.record(
+                self.history_scope(*requester), model, content_digest(image_url.encode("utf-8")), pairs
+            )
+        except Exception as e:
+            logger.debug(f"记录识别历史失败: {e}")
+
+    def format_history(self, keyword: str, matches: list) -> str:
+        """识图历史命令的回复内容"""
+        if not matches:
+            return f"📜 这里还没有识别过「{keyword}」"
+        lines = [f"📜 「{keyword}」的识别记录"]
+        for match in matches:
+            name = f"**{match['character']}**" if self.use_markdown else match["character"]
+            lines.append(f"{name} - 《{match['work']}》 共 {match['count']} 次")
+            for ts, model in match["recent"]:
+                when = time.strftime("%Y-%m-%d %H:%M", time.localtime(ts))
+                lines.append(f"  · {when} {MODEL_NAMES.get(model, '综合识别' if model == FANOUT_MODEL else model)}")
+        return "\n".join(lines)
+
+    async def recognize(self, image_url: str, model: str) -> dict:
+        """获取识别结果：缓存 → 跨进程去重 → URL方式与下载图片base64方式竞速"""
+        cache = self.result_cache
+        url_key = ResultCache.url_key(model, image_url)
+        if cache is not None:
+            cached = await cache.get(url_key)
+            if cached is not None:
+                logger.debug("命中识别结果缓存（URL）")
+                return cached
+
+        claimed, peer_results = await self.claim_shared(url_key)
+        if peer_results is not None:
+            return peer_results
+        try:
+            return await self.race_recognize(image_url, model, url_key)
+        finally:
+            if claimed:
+                await self.shared_state.release(url_key)
+
+    async def race_recognize(self, image_url: str, model: str, url_key: str) -> dict:
+        """URL方式与下载图片base64方式竞速"""
+        cache = self.result_cache
+        host = image_host(image_url)
+        url_task = None
+        url_dispatched = asyncio.Event()
+        if self.breaker.is_open():
+            # 熔断期间不发URL请求；下载后仍可命中内容缓存与近似重复图片
+            logger.debug("熔断器已打开，跳过URL方式")
+            self.metrics.inc("url_skipped", "circuit_open")
+        elif self.path_selector.should_try_url(host):
+            url_task = asyncio.create_task(self.call_animetrace_api_with_url(image_url, model, url_dispatched))
+        else:
+            logger.debug(f"来源 {host} 的URL方式成功率过低，直接使用base64方式")
+            self.metrics.inc("url_skipped", "low_success_rate")
+
+        # 下载与预处理立即开始；base64请求在URL请求发出后的对冲延迟后（或URL方式失败时）才发出
+        fire_base64 = asyncio.Event()
+        hedge_task = None
+        if url_task is None:
+            fire_base64.set()
+        else:
+            hedge_task = asyncio.create_task(self.hedge_after_dispatch(url_dispatched, fire_base64))
+        url_won = asyncio.get_running_loop().create_future()  # URL方式胜出时写入其结果，下载任务据此跳过上传
+        fallback_task = asyncio.create_task(self.recognize_by_download(image_url, model, fire_base64, url_won))
+
+        pending = {fallback_task} if url_task is None else {url_task, fallback_task}
+        url_ok = None
+        winner = None
+        results = None
+        fallback_results = None
+        fallback_error = None
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task is url_task:
+                        url_results = task.result()
+                        url_ok = bool(url_results and url_results.get("data"))
+                        if url_ok and winner is None:
+                            winner, results = "url", url_results
+                            url_won.set_result(url_results)
+                        elif not url_ok:
+                            logger.debug("URL识别方式未返回结果，立即发出base64请求")
+                            fire_base64.set()
+                    elif task.exception() is not None:
+                        fallback_error = task.exception()
+                    else:
+                        fallback_results = task.result()
+                        # base64返回空结果时，若URL方式仍在进行则继续等待
+                        if winner is None and (fallback_results.get("data") or url_task is None or url_task.done()):
+                            winner, results = "base64", fallback_results
+        finally:
+            if hedge_task is not None:
+                hedge_task.cancel()
+            for task in pending:
+                if task is fallback_task and winner == "url":
+                    # 让下载任务在后台完成，按图片内容记录URL方式的结果
+                    self.background_tasks.add(task)
+                    task.add_done_callback(self.forget_background_task)
+                else:
+                    task.cancel()
+
+        # URL方式被base64方式（可能只是命中了缓存）抢先而取消时不计入成功率，url_ok 保持None
+        self.path_selector.record(host, url_ok, winner)
+        self.metrics.inc("path_winner", winner or "none")
+
+        if winner == "url":
+            if cache is not None:
+                await cache.put(url_key, results)
+            return results
+        if winner == "base64":
+            return results
+        if fallback_results is not None:
+            return fallback_results
+        if fallback_error is not None:
+            raise fallback_error
+        return {"data": []}
+
+    async def hedge_after_dispatch(self, url_dispatched: asyncio.Event, fire_base64: asyncio.Event):
+        """URL请求真正发出后开始计时，超过对冲延迟仍未返回则发出base64请求
+
+        URL请求在调度器中排队的时间不计入对冲延迟，否则限流时几乎每次识别都会重复排队。
+        """
+        await url_dispatched.wait()
+        await asyncio.sleep(self.hedge_delay_seconds)
+        if not fire_base64.is_set():
+            logger.debug("URL方式超过对冲延迟仍未返回，发出base64请求")
+            fire_base64.set()
+
+    def forget_background_task(self, task: asyncio.Task):
+        self.background_tasks.discard(task)
+        if not task.cancelled():
+            task.exception()  # 后台任务的错误已在下载/识别时记录日志
+
+    async def recognize_by_download(
+        self, image_url: str, model: str, fire_base64: asyncio.Event, url_won: asyncio.Future = None
+    ) -> dict:
+        """下载图片后按内容识别"""
+        img_bytes = await self.download_image(image_url)
+        digest = content_digest(img_bytes)
+        # 不同URL可能指向同一张图片，按内容哈希再合并一次
+        results = await self.inflight.do(
+            ("content", model, digest),
+            lambda: self.recognize_image_bytes(img_bytes, digest, model, fire_base64, url_won=url_won),
+        )
+        if self.result_cache is not None:
+            await self.result_cache.put(ResultCache.url_key(model, image_url), results)
+        return results
+
+    async def recognize_image_bytes(
+        self,
+        img_bytes: bytes,
+        digest: str,
+        model: str,
+        fire_base64: asyncio.Event = None,
+        prepare=None,
+        url_won: asyncio.Future = None,
+    ) -> dict:
+        """按图片内容识别：内容缓存 → 近似重复 → 等待对冲信号后上传图片识别
+
+        prepare 为返回预处理结果的可等待对象工厂，多个模型共用同一张图片时传入以避免重复预处理。
+        """
+        cache = self.result_cache
+        content_key = ResultCache.content_key(model, digest)
+        if cache is not None:
+            cached = await cache.get(content_key)
+            if cached is not None:
+                logger.debug("命中识别结果缓存（图片内容）")
+                return cached
+
+        if prepare is None:
+            prepare = lambda: self.preprocess_for_upload(img_bytes)  # noqa: E731
+        img_data, image_hash = await prepare()
+        if image_hash is not None:
+            match = self.find_near_duplicate(model, image_hash)
+            if match is not None:
+                results, distance = match
+                logger.debug(f"命中近似重复图片（汉明距离 {distance}）")
+                if cache is not None:
+                    await cache.put(content_key, results)
+                return results
+
+        if fire_base64 is not None:
+            url_results = await self.wait_for_hedge(fire_base64, url_won)
+            if url_results is not None:
+                # URL方式已胜出：直接按图片内容记录其结果，不再上传图片
+                if cache is not None:
+                    await cache.put(content_key, url_results)
+                if image_hash is not None:
+                    self.remember_image_hash(model, image_hash, url_results)
+                return url_results
+        claimed, peer_results = await self.claim_shared(content_key)
+        if peer_results is not None:
+            return peer_results
+        try:
+            results = await self.upload_unless_url_won(img_data, model, url_won)
+            if cache is not None:
+                await cache.put(content_key, results)
+        finally:
+            if claimed:
+                await self.shared_state.release(content_key)
+        if image_hash is not None and results.get("data"):
+            self.remember_image_hash(model, image_hash, results)
+        return results
+
+    async def wait_for_hedge(self, fire_base64: asyncio.Event, url_won: asyncio.Future = None):
+        """等待发出base64请求的信号；期间URL方式胜出则返回其结果"""
+        if url_won is None:
+            await fire_base64.wait()
+            return None
+        if not url_won.done():
+            signal = asyncio.ensure_future(fire_base64.wait())
+            try:
+                await asyncio.wait({signal, url_won}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                signal.cancel()
+        if url_won.done() and not url_won.cancelled():
+            return url_won.result()
+        return None
+
+    async def upload_unless_url_won(self, img_data: bytes, model: str, url_won: asyncio.Future = None) -> dict:
+        """上传图片识别；URL方式在上传开始前或上传期间胜出时不再上传（或取消上传），改用其结果"""
+        if url_won is not None and not url_won.done():
+            upload = asyncio.ensure_future(self.call_animetrace_api_with_image(img_data, model))
+            try:
+                await asyncio.wait({upload, url_won}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                if not upload.done():
+                    upload.cancel()
+            if upload.done():
+                return upload.result()
+        if url_won is not None and url_won.done() and not url_won.cancelled():
+            logger.debug("URL方式已胜出，取消上传图片")
+            return url_won.result()
+        return await self.call_animetrace_api_with_image(img_data, model)
+
+    async def recognize_all(self, image_url: str) -> dict:
+        """多模型并发识别：图片只下载、预处理一次，返回 {模型: 结果或异常}"""
+        models = self.fanout_models
+        results = {}
+        cache = self.result_cache
+        if cache is not None:
+            for model in models:
+                cached = await cache.get(ResultCache.url_key(model, image_url))
+                if cached is not None:
+                    results[model] = cached
+        pending = [model for model in models if model not in results]
+        if not pending:
+            return results
+
+        img_bytes = await self.download_image(image_url)
+        digest = content_digest(img_bytes)
+        prepare_task = None
+
+        def prepare():
+            nonlocal prepare_task
+            if prepare_task is None:
+                prepare_task = asyncio.ensure_future(self.preprocess_for_upload(img_bytes))
+            return prepare_task
+
+        async def run(model: str):
+            model_results = await self.inflight.do(
+                ("content", model, digest),
+                lambda: self.recognize_image_bytes(img_bytes, digest, model, prepare=prepare),
+            )
+            if cache is not None:
+                await cache.put(ResultCache.url_key(model, image_url), model_results)
+            return model_results
+
+        outcomes = await asyncio.gather(*(run(model) for model in pending), return_exceptions=True)
+        for model, outcome in zip(pending, outcomes):
+            if isinstance(outcome, asyncio.CancelledError):
+                raise outcome
+            results[model] = outcome
+        if all(isinstance(results[model], Exception) for model in models):
+            raise results[models[0]]
+        return {model: results[model] for model in models}
+
+    async def recognize_avatar(self, uin: str, avatar_url: str, model: str) -> dict:
+        """识别QQ头像：头像未变化时复用之前的结果"""
+        cache = self.avatar_cache
+        entry = cache.get(uin)
+        if entry is not None and model in entry.results and cache.is_fresh(entry):
+            cache.hits += 1
+            logger.debug(f"命中头像识别缓存: {uin}")
+            return entry.results[model]
+
+        headers = entry.conditional_headers() if entry is not None and model in entry.results else None
+        status, img_bytes, validators = await self.fetch_image(avatar_url, headers)
+        if status == 304:
+            cache.revalidated += 1
+            entry.checked_at = time.monotonic()
+            logger.debug(f"头像未变化（HTTP 304）: {uin}")
+            return entry.results[model]
+
+        digest = content_digest(img_bytes)
+        if entry is None or entry.digest != digest:
+            if entry is not None:
+                cache.changed += 1
+                logger.debug(f"头像已更换: {uin}")
+            entry = AvatarEntry(digest)
+            cache.put(uin, entry)
+        else:
+            cache.revalidated += 1
+        entry.etag, entry.last_modified = validators
+        entry.checked_at = time.monotonic()
+        if model in entry.results:
+            return entry.results[model]
+
+        # 已下载头像数据，直接按内容识别，不再走URL方式
+        results = await self.inflight.do(
+            ("content", model, digest),
+            lambda: self.recognize_image_bytes(img_bytes, digest, model),
+        )
+        entry.results[model] = results
+        return results
+
+    async def claim_shared(self, cache_key: str) -> tuple:
+        """跨进程去重：返回 (是否获得租约, 其他进程的识别结果)
+
+        其他进程正在识别同一键时轮询共享缓存等待其结果；对方失败或租约过期后由本进程接手。
+        未启用共享状态时返回 (False, None)。
+        """
+        shared = self.shared_state
+        if not self.shared_dedupe:
+            return False, None
+        if await shared.claim(cache_key):
+            # 对方可能在本进程查询缓存后刚写入结果并释放租约
+            results = await self.result_cache.get_persisted(cache_key)
+            if results is None:
+                return True, None
+            await shared.release(cache_key)
+            return False, results
+
+        shared.peer_waits += 1
+        logger.debug("其他进程正在识别同一张图片，等待其结果")
+        deadline = time.monotonic() + shared.lease_seconds
+        while time.monotonic() < deadline:
+            await asyncio.sleep(shared.poll_interval)
+            results = await self.result_cache.get_persisted(cache_key)
+            if results is not None:
+                self.metrics.inc("shared", "peer_result")
+                return False, results
+            if await shared.claim(cache_key):
+                return True, None
+        return False, None
+
+    def find_near_duplicate(self, model: str, image_hash: int):
+        """在感知哈希索引中查找近似重复图片的识别结果"""
+        index = self.phash_indexes.get(model)
+        if index is None or not is_distinctive(image_hash):
+            return None
+        return index.search(image_hash)
+
+    def remember_image_hash(self, model: str, image_hash: int, results: dict):
+        """记录图片感知哈希与识别结果（只保留格式化所需的第一个结果）"""
+        if not is_distinctive(image_hash):
+            return
+        index = self.phash_indexes.get(model)
+        if index is None:
+            index = HammingIndex(self.phash_max_distance, self.phash_max_entries)
+            self.phash_indexes[model] = index
+        index.add(image_hash, {"data": results["data"][:1]})
+
     async def extract_mentioned_user(self, event: AstrMessageEvent) -> str:
         """从事件中提取被@的用户QQ号或手动输入的QQ号"""
         messages = event.get_messages()
         logger.debug(f"开始提取被@用户或手动QQ号，消息列表: {messages}")
 
         # 首先检查是否有手动输入的QQ号
-        full_text = ""
-        for msg in messages:
-            if hasattr(msg, "text"):
-                full_text += str(msg.text)
-            elif hasattr(msg, "type") and msg.type == "Plain":
-                full_text += str(msg)
+        full_text = get_message_text(messages)
 
         logger.debug(f"提取的完整文本: '{full_text}'")
 
         # 匹配手动输入QQ号的格式：头像识别 12345678910 或 头像识别12345678910
-        import re
-        qq_match = re.search(r"头像(?:动漫|gal)?识别\s*(\d{5,12})", full_text)
+        qq_match = MANUAL_QQ_PATTERN.search(full_text)
         if qq_match:
             qq_number = qq_match.group(1)
             logger.debug(f"找到手动输入的QQ号: {qq_number}")
@@ -354,25 +1288,30 @@ class AnimeTracePlugin(Star):
         return None
 
     async def extract_image_from_event(self, event: AstrMessageEvent) -> str:
-        """从事件中提取图片URL"""
+        """从事件中提取图片URL（当前消息优先，其次是引用消息）"""
+        image_urls = self.extract_images_from_event(event, limit=1)
+        if not image_urls:
+            # 如果没有找到图片，记录日志
+            logger.debug("在当前消息和引用消息中均未找到图片")
+            return None
+        return image_urls[0]
+
+    def extract_images_from_event(self, event: AstrMessageEvent, limit: int = 0) -> list:
+        """提取当前消息与引用消息中的全部图片URL（按出现顺序去重，limit>0 时最多返回limit个）"""
         messages = event.get_messages()
+        image_urls = []
+
+        def add(url):
+            if url and url not in image_urls:
+                image_urls.append(url)
+            return 0 < limit <= len(image_urls)
 
         # 首先检查当前消息中的图片
         for msg in messages:
             # 标准图片组件
             if isinstance(msg, MsgImage):
-                if hasattr(msg, "url") and msg.url:
-                    return msg.url.strip()
-                if hasattr(msg, "file") and msg.file:
-                    # 从file字段提取URL - 处理微信格式
-                    file_content = str(msg.file)
-                    if "http" in file_content:
-                        import re
-
-                        # 提取URL并移除反引号
-                        urls = re.findall(r"https?://[^\s\`\']+", file_content)
-                        if urls:
-                            return urls[0].strip("`'")
+                if add(self.get_image_url(msg)):
+                    return image_urls
 
             # QQ官方平台特殊处理
             if hasattr(msg, "type") and msg.type == "Plain":
@@ -391,29 +1330,44 @@ class AnimeTracePlugin(Star):
                         # 在引用消息的chain中查找图片
                         for reply_msg in msg.chain:
                             if isinstance(reply_msg, MsgImage):
-                                if hasattr(reply_msg, "url") and reply_msg.url:
-                                    logger.debug(f"在引用消息中找到图片URL: {reply_msg.url}")
-                                    return reply_msg.url.strip()
-                                if hasattr(reply_msg, "file") and reply_msg.file:
-                                    file_content = str(reply_msg.file)
-                                    if "http" in file_content:
-                                        import re
-                                        urls = re.findall(r"https?://[^\s\`\']+", file_content)
-                                        if urls:
-                                            logger.debug(f"在引用消息文件中找到图片URL: {urls[0]}")
-                                            return urls[0].strip("`'")
+                                url = self.get_image_url(reply_msg)
+                                if url:
+                                    logger.debug(f"在引用消息中找到图片URL: {url}")
+                                if add(url):
+                                    return image_urls
 
         except Exception as e:
             logger.warning(f"检查引用消息图片时出错: {str(e)}")
 
-        # 如果没有找到图片，记录日志
-        logger.debug("在当前消息和引用消息中均未找到图片")
+        return image_urls
+
+    def get_image_url(self, msg) -> str:
+        """从图片组件中取出URL"""
+        if hasattr(msg, "url") and msg.url:
+            return msg.url.strip()
+        if hasattr(msg, "file") and msg.file:
+            # 从file字段提取URL - 处理微信格式
+            file_content = str(msg.file)
+            if "http" in file_content:
+                # 提取URL并移除反引号
+                urls = IMAGE_URL_PATTERN.findall(file_content)
+                if urls:
+                    return urls[0].strip("`'")
         return None
 
-    async def download_and_process_image(self, image_url: str) -> str:
-        """下载并处理图片"""
+    async def download_image(self, image_url: str) -> bytes:
+        """下载图片原始数据"""
+        _, img_data, _ = await self.fetch_image(image_url)
+        return img_data
+
+    async def fetch_image(self, image_url: str, headers: dict = None) -> tuple:
+        """下载图片，返回 (HTTP状态码, 图片数据, (ETag, Last-Modified))
+
+        传入条件请求头时，服务端返回 304 则图片数据为 None。
+        """
         logger.debug(f"下载图片: {image_url[:100]}...")
 
+        start = time.perf_counter()
         try:
             # 处理Telegram的特殊URL格式
             if image_url.startswith("telegram://"):
@@ -424,78 +1378,167 @@ class AnimeTracePlugin(Star):
                 # 在实际环境中，需要调用Telegram Bot API获取文件路径
                 # Telegram文件现在支持识别，继续正常处理流程
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get(image_url, timeout=30) as response:
-                    if response.status != 200:
-                        raise Exception(f"图片下载失败: HTTP {response.status}")
-                    img_data = await response.read()
-
-            # 处理图片
-            img = PILImage.open(BytesIO(img_data))
-
-            # 调整大小（最大1024px）
-            if max(img.size) > 1024:
-                ratio = 1024 / max(img.size)
-                new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
-                img = img.resize(new_size, PILImage.LANCZOS)
-
-            # 转换为JPEG并编码为base64
-            buffered = BytesIO()
-            img.save(buffered, format="JPEG", quality=85)
-            base64_data = base64.b64encode(buffered.getvalue()).decode("utf-8")
-
-            logger.debug(f"图片处理完成，大小: {len(base64_data)} 字符")
-            return base64_data
+            session = await self.get_http_session()
+            # 单次请求的超时设置会整体替换会话设置，连接/读取超时需要一并带上
+            timeout = aiohttp.ClientTimeout(
+                total=self.download_timeout,
+                connect=self.http_connect_timeout,
+                sock_read=self.http_read_timeout,
+            )
+            async with session.get(image_url, headers=headers, timeout=timeout) as response:
+                validators = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+                if response.status == 304 and headers:
+                    return 304, None, validators
+                if response.status != 200:
+                    raise Exception(f"图片下载失败: HTTP {response.status}")
+                max_bytes = self.download_max_bytes
+                if max_bytes > 0 and (response.content_length or 0) > max_bytes:
+                    raise Exception(f"图片过大（{response.content_length} 字节）")
+                # 边下载边检查大小，超出上限立即中止
+                buffer = bytearray()
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    buffer += chunk
+                    if 0 < max_bytes < len(buffer):
+                        raise Exception(f"图片过大（超过 {max_bytes} 字节）")
+                return response.status, buffer, validators
         except asyncio.TimeoutError:
             raise Exception("图片下载超时，请稍后重试")
         except Exception as e:
             logger.error(f"图片处理失败: {str(e)}")
             raise Exception(f"图片处理失败: {str(e)}")
+        finally:
+            self.metrics.observe("download", "", "", time.perf_counter() - start)
+
+    async def preprocess(self, img_data: bytes, with_hash: bool = True, as_base64: bool = True) -> tuple:
+        """在工作池中预处理图片，返回 (JPEG数据或base64字符串, 感知哈希或None)"""
+        try:
+            img_payload, image_hash, timings = await self.image_pool.run(
+                preprocess_image,
+                img_data,
+                with_hash,
+                self.image_max_size,
+                self.image_quality,
+                self.image_max_bytes,
+                as_base64,
+            )
+        except QueueFullError:
+            raise
+        except Exception as e:
+            logger.error(f"图片处理失败: {str(e)}")
+            raise Exception(f"图片处理失败: {str(e)}")
+        self.image_pool.record(timings)
+        for stage, seconds in timings.items():
+            self.metrics.observe(f"image_{stage}", "", self.image_pool.mode, seconds)
+        logger.debug(
+            f"图片处理完成，大小: {len(img_payload)} {'字符' if as_base64 else '字节'}，耗时: "
+            + ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in timings.items())
+        )
+        return img_payload, image_hash
+
+    async def preprocess_for_upload(self, img_data: bytes) -> tuple:
+        """按当前上传方式预处理图片（同时计算感知哈希）"""
+        return await self.preprocess(img_data, with_hash=self.phash_enabled, as_base64=self.upload_mode == "base64")
+
+    async def call_animetrace_api_with_image(self, img_payload, model: str) -> dict:
+        """按配置的上传方式调用API；multipart被拒绝时回退到base64方式"""
+        if self.upload_mode == "base64":
+            return await self.call_animetrace_api(img_payload, model)
+        try:
+            return await self.call_animetrace_api_with_file(img_payload, model)
+        except Exception as e:
+            if not any(f"HTTP {status}" in str(e) for status in (400, 413, 415)):
+                raise
+            logger.warning(f"multipart上传被拒绝（{e}），回退到base64方式")
+            return await self.call_animetrace_api(base64.b64encode(img_payload).decode("utf-8"), model)
 
     async def call_animetrace_api(self, img_base64: str, model: str) -> dict:
         """使用base64调用AnimeTrace API"""
         payload = {"base64": img_base64, "is_multi": 1, "model": model, "ai_detect": 0}
 
-        model_name_map = {
-            "pre_stable": "动漫识别模型",
-            "full_game_model_kira": "GalGame识别模型",
-            "animetrace_high_beta": "通用识别模型"
-        }
-        logger.debug(f"调用API - 模型: {model_name_map.get(model, model)} (base64方式)")
-
+        logger.debug(f"调用API - 模型: {MODEL_NAMES.get(model, model)}模型 (base64方式)")
+        return await self.post_search(payload, "base64", model)
+
+    async def call_animetrace_api_with_file(self, img_bytes: bytes, model: str) -> dict:
+        """以multipart文件方式调用AnimeTrace API（不做base64编码，直接上传JPEG数据）"""
+        form = aiohttp.FormData()
+        form.add_field("file", img_bytes, filename="image.jpg", content_type="image/jpeg")
+        form.add_field("is_multi", "1")
+        form.add_field("model", model)
+        form.add_field("ai_detect", "0")
+
+        logger.debug(f"调用API - 模型: {MODEL_NAMES.get(model, model)}模型 (multipart方式, {len(img_bytes)} 字节)")
+        return await self.post_search(form, "multipart", model)
+
+    async def post_search(self, data, mode: str, model: str = "") -> dict:
+        """向AnimeTrace提交图片数据并解析结果"""
+        probe = self.breaker.before_call()
+        ok = None
+        start = time.monotonic()
+        # 排队等待名额时被取消或被拒绝，也要在 finally 中归还半开探测名额
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.api_url, data=payload, timeout=30) as response:
+            async with self.scheduler.slot():
+                start = time.monotonic()
+                session = await self.get_http_session()
+                async with session.post(self.api_url, data=data, timeout=self.api_timeout()) as response:
                     if response.status != 200:
+                        ok = response.status < 500 and response.status != 429
+                        self.metrics.inc("api_errors", f"{mode}:HTTP {response.status}")
+                        self.check_throttled(response)
                         error_text = await response.text()
                         logger.warning(f"API返回错误状态: HTTP {response.status}, 响应: {error_text[:200]}")
                         raise Exception(f"API错误: HTTP {response.status}")
 
                     result = await response.json()
+                    ok = True
+                    self.scheduler.report_success()
                     logger.debug(f"API返回: {len(result.get('data', []))} 个结果")
                     return result
         except asyncio.TimeoutError:
-            logger.error("API调用超时")
+            ok = False
+            self.metrics.inc("api_errors", f"{mode}:timeout")
+            logger.error(f"API调用超时（{self.breaker.request_timeout():.1f} 秒）")
             raise Exception("识别服务响应超时，请稍后重试")
         except Exception as e:
-            logger.error(f"base64 API调用失败: {str(e)}")
+            if isinstance(e, aiohttp.ClientError):
+                ok = False
+                self.metrics.inc("api_errors", f"{mode}:{type(e).__name__}")
+            logger.error(f"{mode} API调用失败: {str(e)}")
             raise
-
-    async def call_animetrace_api_with_url(self, image_url: str, model: str) -> dict:
-        """使用URL直接调用AnimeTrace API"""
+        finally:
+            elapsed = time.monotonic() - start
+            self.breaker.record(ok, elapsed, probe)
+            if ok is not None:
+                self.metrics.observe("api_call", model, mode, elapsed)
+
+    async def call_animetrace_api_with_url(
+        self, image_url: str, model: str, dispatched: asyncio.Event = None
+    ) -> dict:
+        """使用URL直接调用AnimeTrace API（失败时返回空结果，由上层回退到base64方式）
+
+        dispatched 在请求获得调度名额、真正发出时置位。
+        """
         payload = {"url": image_url, "is_multi": 1, "model": model, "ai_detect": 0}
 
-        model_name_map = {
-            "pre_stable": "动漫识别模型",
-            "full_game_model_kira": "GalGame识别模型",
-            "animetrace_high_beta": "通用识别模型"
-        }
-        logger.debug(f"调用API - 模型: {model_name_map.get(model, model)} (URL方式)")
+        logger.debug(f"调用API - 模型: {MODEL_NAMES.get(model, model)}模型 (URL方式)")
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.api_url, data=payload, timeout=30) as response:
+            probe = self.breaker.before_call()
+        except CircuitOpenError:
+            return {"data": []}
+        ok = None
+        start = time.monotonic()
+        try:
+            async with self.scheduler.slot():
+                start = time.monotonic()
+                if dispatched is not None:
+                    dispatched.set()
+                session = await self.get_http_session()
+                async with session.post(self.api_url, data=payload, timeout=self.api_timeout()) as response:
                     if response.status != 200:
+                        # 422/500 多为AnimeTrace无法获取该图片URL，不计入服务故障
+                        ok = response.status not in (429, 502, 503, 504)
+                        self.metrics.inc("api_errors", f"url:HTTP {response.status}")
+                        self.check_throttled(response)
                         # 如果URL方式失败，返回空结果让上层逻辑回退到base64方式
                         if response.status in [422, 500, 502, 503, 504]:
                             logger.debug(f"URL识别失败 (HTTP {response.status})，准备回退到base64方式")
@@ -503,14 +1546,58 @@ class AnimeTracePlugin(Star):
                         raise Exception(f"API错误: HTTP {response.status}")
 
                     result = await response.json()
+                    ok = True
+                    self.scheduler.report_success()
                     logger.debug(f"API返回: {len(result.get('data', []))} 个结果")
                     return result
         except Exception as e:
+            # 包括排队已满（QueueFullError），base64方式仍可能给出结果
+            if isinstance(e, (asyncio.TimeoutError, aiohttp.ClientError)):
+                ok = False
+                self.metrics.inc("api_errors", f"url:{type(e).__name__}")
             logger.warning(f"URL方式调用失败: {str(e)}，准备回退到base64方式")
             return {"data": []}
+        finally:
+            elapsed = time.monotonic() - start
+            self.breaker.record(ok, elapsed, probe)
+            if ok is not None:
+                self.metrics.observe("api_call", model, "url", elapsed)
+
+    def api_timeout(self) -> aiohttp.ClientTimeout:
+        """AnimeTrace 请求的超时设置：总超时随最近的p95耗时自适应"""
+        return aiohttp.ClientTimeout(
+            total=self.breaker.request_timeout(),
+            connect=self.http_connect_timeout,
+            sock_read=self.http_read_timeout,
+        )
+
+    def on_breaker_state_change(self, old: str, new: str, reason: str):
+        """熔断器状态变化时记录日志"""
+        if new == "open":
+            logger.warning(f"AnimeTrace 熔断器 {old} → {new}: {reason}，{self.breaker.retry_in():.0f} 秒内直接拒绝识别请求")
+        else:
+            logger.info(f"AnimeTrace 熔断器 {old} → {new}: {reason}")
+
+    def check_throttled(self, response):
+        """上游返回限流/过载状态时通知调度器退避"""
+        if response.status in (429, 503):
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            logger.warning(f"AnimeTrace 返回 HTTP {response.status}，暂停派发请求（Retry-After: {retry_after}）")
+            self.scheduler.report_throttled(retry_after)
+
+    def top_characters(self, data, model: str) -> tuple:
+        """识别结果的前5个 (角色, 作品)"""
+        if model == FANOUT_MODEL:
+            ranked, _ = self.rank_merged_results(data)
+            return tuple(key for key, _ in ranked)
+        first_result = (data.get("data") or [{}])[0]
+        return tuple(
+            (char.get("character", "未知角色"), char.get("work", "未知作品"))
+            for char in first_result.get("character", [])[:5]
+        )
 
     def format_results(self, data: dict, model: str) -> str:
-        """格式化识别结果"""
+        """格式化识别结果（相同的前5项结果复用已生成的回复）"""
         if not data.get("data") or not data["data"]:
             return "🔍 未找到匹配的信息"
 
@@ -520,27 +1607,21 @@ class AnimeTracePlugin(Star):
         if not characters:
             return "🔍 未识别到具体角色信息"
 
-        model_name_map = {
-            "pre_stable": "动漫识别",
-            "full_game_model_kira": "GalGame识别",
-            "animetrace_high_beta": "通用识别"
-        }
-        emoji_map = {
-            "pre_stable": "🎌",
-            "full_game_model_kira": "🎮",
-            "animetrace_high_beta": "🔍"
-        }
-        model_name = model_name_map.get(model, "图片识别")
-        emoji = emoji_map.get(model, "🔍")
+        top = self.top_characters(data, model)
+        key = (model, self.use_markdown, top, len(characters) if len(characters) > 5 else 0)
+        reply = self.reply_table.get(key)
+        if reply is not None:
+            return reply
+
+        model_name = MODEL_NAMES.get(model, "图片识别")
+        emoji = MODEL_EMOJIS.get(model, "🔍")
 
         if self.use_markdown:
             # Markdown格式输出
             lines = [f"**{emoji} {model_name}结果**", "=" * 20]
             
             # 显示前5个结果
-            for i, char in enumerate(characters[:5]):
-                name = char.get("character", "未知角色")
-                work = char.get("work", "未知作品")
+            for i, (name, work) in enumerate(top):
                 lines.append(f"{i + 1}. **{name}** - 《{work}》")
             
             if len(characters) > 5:
@@ -552,9 +1633,7 @@ class AnimeTracePlugin(Star):
             lines = [f"{emoji} {model_name}结果"]
             
             # 显示前5个结果
-            for i, char in enumerate(characters[:5]):
-                name = char.get("character", "未知角色")
-                work = char.get("work", "未知作品")
+            for i, (name, work) in enumerate(top):
                 lines.append(f"{i + 1}. {name} - 《{work}》")
             
             if len(characters) > 5:
@@ -562,33 +1641,192 @@ class AnimeTracePlugin(Star):
             
             lines.append("数据来源: AnimeTrace，仅供参考")
 
+        reply = "\n".join(lines)
+        self.reply_table.put(key, reply)
+        return reply
+
+    def rank_merged_results(self, results_by_model: dict) -> tuple:
+        """按模型间一致程度排序，返回 ([((角色, 作品), 支持的模型列表)] 前5项, 失败的模型列表)"""
+        # (角色, 作品) -> [支持的模型列表, 排名倒数之和]
+        candidates = {}
+        failed = []
+        for model, data in results_by_model.items():
+            if isinstance(data, Exception):
+                failed.append(model)
+                continue
+            first_result = (data.get("data") or [{}])[0]
+            for rank, char in enumerate(first_result.get("character", [])[:5]):
+                key = (char.get("character", "未知角色"), char.get("work", "未知作品"))
+                entry = candidates.setdefault(key, [[], 0.0])
+                if model not in entry[0]:
+                    entry[0].append(model)
+                    entry[1] += 1 / (rank + 1)
+
+        ranked = sorted(candidates.items(), key=lambda item: (-len(item[1][0]), -item[1][1]))[:5]
+        return [(key, models) for key, (models, _) in ranked], failed
+
+    def format_merged_results(self, results_by_model: dict) -> str:
+        """合并多个模型的识别结果，按模型间一致程度排序"""
+        ranked, failed = self.rank_merged_results(results_by_model)
+        total = len(results_by_model)
+
+        if self.use_markdown:
+            lines = ["**🧩 综合识别结果**", "=" * 20]
+        else:
+            lines = ["🧩 综合识别结果"]
+        if not ranked:
+            lines.append("🔍 未识别到具体角色信息")
+        for i, ((name, work), models) in enumerate(ranked):
+            agreement = f"{len(models)}/{total} {''.join(MODEL_EMOJIS.get(m, '🔍') for m in models)}"
+            if self.use_markdown:
+                lines.append(f"{i + 1}. **{name}** - 《{work}》 ({agreement})")
+            else:
+                lines.append(f"{i + 1}. {name} - 《{work}》 ({agreement})")
+        if failed:
+            lines.append("⚠️ " + "、".join(MODEL_NAMES.get(m, m) for m in failed) + "失败")
+
+        lines.append("\n💡 数据来源: AnimeTrace，仅供参考" if self.use_markdown else "数据来源: AnimeTrace，仅供参考")
+        return "\n".join(lines)
+
+    def component_stats(self) -> dict:
+        """各组件的运行统计"""
+        stats = {
+            "scheduler": self.scheduler.stats(),
+            "breaker": self.breaker.stats(),
+            "inflight": self.inflight.stats(),
+            "sessions": self.waiting_sessions.stats(),
+            "avatar_cache": self.avatar_cache.stats(),
+            "image_pool": self.image_pool.stats(),
+            "replies": self.reply_table.stats(),
+            "prefetch": self.prefetcher.stats(),
+        }
+        if self.shared_state is not None:
+            stats["shared"] = self.shared_state.stats()
+        if self.history is not None:
+            stats["history"] = self.history.stats()
+        if self.llm_summaries is not None:
+            stats["llm_summaries"] = self.llm_summaries.stats()
+        if self.result_cache is not None:
+            stats["cache"] = self.result_cache.stats()
+        return stats
+
+    def format_status(self) -> str:
+        """识图状态命令的回复内容"""
+        uptime = int(time.time() - self.metrics.started_at)
+        lines = [f"📊 识图状态（已运行 {uptime // 3600}小时{uptime % 3600 // 60}分）"]
+        if self.metrics.enabled:
+            stages = self.metrics.stages()
+            if stages:
+                lines.append("⏱️ 阶段耗时（次数 / 平均 / p95 / 最大）")
+                for stage, h in sorted(stages.items()):
+                    lines.append(
+                        f"- {stage}: {h.count} / {h.total / h.count * 1000:.0f}ms"
+                        f" / {h.quantile(0.95) * 1000:.0f}ms / {h.peak * 1000:.0f}ms"
+                    )
+            for name, title in (("path_winner", "🔀 胜出方式"), ("url_skipped", "⏭️ 跳过URL方式"),
+                                ("api_errors", "❗ 接口错误"), ("recognition_errors", "❌ 识别失败")):
+                counters = self.metrics.counters(name)
+                if counters:
+                    lines.append(f"{title}: " + "，".join(f"{k} ×{v}" for k, v in sorted(counters.items())))
+        else:
+            lines.append("⏱️ 未启用耗时统计（metrics_enabled）")
+
+        stats = self.component_stats()
+        cache = stats.get("cache")
+        if cache is not None:
+            lines.append(
+                f"💾 结果缓存: 命中率 {cache['hit_rate']:.0%}（命中 {cache['hits']}，未命中 {cache['misses']}，"
+                f"内存条目 {cache['memory_entries']}）"
+            )
+        scheduler = stats["scheduler"]
+        lines.append(
+            f"🚦 调度队列: 进行中 {scheduler['in_flight']}，排队 {scheduler['queued']}，"
+            f"已拒绝 {scheduler['rejected']}，限流 {scheduler['throttled']} 次"
+        )
+        breaker = stats["breaker"]
+        lines.append(
+            f"🚧 熔断器: {breaker['state']}，当前超时 {breaker['timeout']:.1f}s，"
+            f"p95 {breaker['p95_latency']:.2f}s，已熔断 {breaker['opened']} 次"
+        )
+        inflight = stats["inflight"]
+        lines.append(f"🔗 合并请求: 执行 {inflight['executed']}，共享 {inflight['shared']}")
+        startup = self.startup
+        lines.append(
+            f"🚀 启动耗时: 导入 {startup['import_ms']:.0f}ms，初始化 {startup['initialize_ms']:.0f}ms，"
+            f"快照恢复 {startup['restored']} 条"
+        )
+        lines.append(f"⏳ 等待发送图片: {stats['sessions']['waiting']}")
         return "\n".join(lines)
 
-    async def timeout_check(self, user_id: str):
-        """超时检查"""
+    def collect_gauges(self) -> dict:
+        """把各组件统计中的数值展开为 Prometheus 瞬时值"""
+        gauges = {}
+        for component, values in self.component_stats().items():
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges[f"{component}_{key}"] = value
+        gauges["breaker_open"] = int(self.breaker.state != "closed")
+        gauges["startup_import_seconds"] = self.startup["import_ms"] / 1000
+        gauges["startup_initialize_seconds"] = self.startup["initialize_ms"] / 1000
+        return gauges
+
+    async def export_metrics(self):
+        """把当前统计写入 Prometheus 文本文件（供 node_exporter textfile 采集）"""
+        text = self.metrics.render_prometheus(self.collect_gauges())
+        await asyncio.to_thread(write_text_atomic, self.metrics_export_path, text)
+
+    async def export_metrics_loop(self):
+        while True:
+            await asyncio.sleep(self.metrics_export_interval)
+            try:
+                await self.export_metrics()
+            except Exception as e:
+                logger.warning(f"导出统计数据失败: {e}")
+
+    async def on_session_timeout(self, session_key: tuple, session):
+        """等待会话超时：向原会话发送超时提示"""
         try:
-            await asyncio.sleep(self.timeout_seconds)  # 等待配置的超时时间
-            if user_id in self.waiting_sessions:
-                # 超时后仍然在等待，发送超时消息
-                session = self.waiting_sessions[user_id]
-                event = session["event"]
-                del self.waiting_sessions[user_id]
-                del self.timeout_tasks[user_id]
-                try:
-                    await event.send(event.plain_result(self.prompt_timeout))
-                    logger.debug(f"用户 {user_id} 的图片识别请求已超时")
-                except Exception as send_error:
-                    logger.warning(f"发送超时消息失败: {send_error}")
-                    # 如果发送超时消息失败，记录日志但不影响清理操作
-        except asyncio.CancelledError:
-            # 任务被取消，说明用户已经发送了图片
-            pass
-        except Exception as e:
-            logger.error(f"超时检查任务异常: {str(e)}")
+            await self.context.send_message(session.unified_msg_origin, MessageChain().message(self.prompt_timeout))
+            logger.debug(f"用户 {session_key[2]} 的图片识别请求已超时")
+        except Exception as send_error:
+            logger.warning(f"发送超时消息失败: {send_error}")
+            # 如果发送超时消息失败，记录日志但不影响清理操作
 
     async def terminate(self):
         logger.info("动漫/Gal/二游识别插件已卸载")
-        # 取消所有超时任务
-        for task in self.timeout_tasks.values():
+        if self.metrics_export_task is not None:
+            self.metrics_export_task.cancel()
+            self.metrics_export_task = None
+            try:
+                await self.export_metrics()
+            except Exception as e:
+                logger.warning(f"导出统计数据失败: {e}")
+        # 停止超时处理任务并清空等待会话
+        self.waiting_sessions.close()
+        self.prefetcher.close()
+        for task in list(self.background_tasks):
             task.cancel()
-        self.timeout_tasks.clear()
+        if self.snapshot_enabled:
+            try:
+                await self.save_snapshot()
+            except Exception as e:
+                logger.warning(f"保存热状态快照失败: {e}")
+        # 关闭共享HTTP会话
+        if self.http_session is not None and not self.http_session.closed:
+            await self.http_session.close()
+        self.http_session = None
+        if self.shared_state is not None:
+            self.scheduler.global_limiter = None
+            self.shared_state.close()
+            self.shared_state = None
+            self.shared_dedupe = False
+        if self.history is not None:
+            self.history.close()  # 落盘尚未写入的记录
+            self.history = None
+        if self.result_cache is not None:
+            logger.info(f"识别结果缓存统计: {self.result_cache.stats()}")
+            self.result_cache.close()
+            self.result_cache = None
+        logger.info(f"熔断器统计: {self.breaker.stats()}")
+        logger.info(f"图片预处理统计: {self.image_pool.stats()}")
+        self.image_pool.shutdown()
@@ -0,0 +1,146 @@
+import os
+import time
+from contextlib import nullcontext
+
+# 耗时直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_NULL_TIMER = nullcontext()
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "peak")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)  # 最后一个桶为 +Inf
+        self.count = 0
+        self.total = 0.0
+        self.peak = 0.0
+
+    def observe(self, seconds: float):
+        index = 0
+        for bound in LATENCY_BUCKETS:
+            if seconds <= bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.peak:
+            self.peak = seconds
+
+    def quantile(self, q: float) -> float:
+        """按桶估算分位数（返回所在桶的上界，落在 +Inf 桶时返回最大值）"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.peak)
+        return self.peak
+
+
+class _Timer:
+    __slots__ = ("metrics", "key", "start")
+
+    def __init__(self, metrics, key):
+        self.metrics = metrics
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(*self.key, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """识别流程各阶段的耗时直方图与计数器
+
+    耗时按 (阶段, 模型, 方式) 分别统计；关闭时 timer() 返回共享的空上下文，
+    observe()/inc() 直接返回，热路径上几乎没有额外开销。
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.started_at = time.time()
+        self._histograms = {}  # (stage, model, mode) -> Histogram
+        self._counters = {}  # (name, label) -> int
+
+    def timer(self, stage: str, model: str = "", mode: str = ""):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, (stage, model, mode))
+
+    def observe(self, stage: str, model: str, mode: str, seconds: float):
+        if not self.enabled:
+            return
+        key = (stage, model, mode)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def inc(self, name: str, label: str = "", amount: int = 1):
+        if not self.enabled:
+            return
+        key = (name, label)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def stages(self) -> dict:
+        """按阶段汇总（合并模型与方式），供状态命令展示"""
+        merged = {}
+        for (stage, _, _), histogram in self._histograms.items():
+            total = merged.get(stage)
+            if total is None:
+                total = merged[stage] = Histogram()
+            total.count += histogram.count
+            total.total += histogram.total
+            total.peak = max(total.peak, histogram.peak)
+            total.counts = [a + b for a, b in zip(total.counts, histogram.counts)]
+        return merged
+
+    def counters(self, name: str) -> dict:
+        return {label: value for (counter, label), value in self._counters.items() if counter == name}
+
+    def render_prometheus(self, gauges: dict = None) -> str:
+        """导出为 Prometheus 文本格式；gauges 为 {指标名: 数值} 的附加瞬时值"""
+        lines = [
+            "# HELP shitu_stage_seconds 识别流程各阶段耗时",
+            "# TYPE shitu_stage_seconds histogram",
+        ]
+        for (stage, model, mode), histogram in sorted(self._histograms.items()):
+            labels = f'stage="{stage}",model="{model}",mode="{mode}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'shitu_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'shitu_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"shitu_stage_seconds_sum{{{labels}}} {histogram.total:.6f}")
+            lines.append(f"shitu_stage_seconds_count{{{labels}}} {histogram.count}")
+
+        names = sorted({name for name, _ in self._counters})
+        for name in names:
+            lines.append(f"# TYPE shitu_{name}_total counter")
+            for label, value in sorted(self.counters(name).items()):
+                lines.append(f'shitu_{name}_total{{label="{label}"}} {value}')
+
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE shitu_{name} gauge")
+            lines.append(f"shitu_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def write_text_atomic(path: str, text: str):
+    """先写临时文件再替换，避免采集方读到写了一半的文件"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
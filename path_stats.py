@@ -0,0 +1,81 @@
+from urllib.parse import urlparse
+
+
+def image_host(image_url: str) -> str:
+    """提取图片来源主机名（非http链接返回协议名，如 telegram）"""
+    parsed = urlparse(image_url)
+    return parsed.hostname or parsed.scheme or "unknown"
+
+
+class HostStats:
+    __slots__ = ("url_attempts", "url_successes", "url_wins", "base64_wins", "skipped")
+
+    def __init__(self):
+        self.url_attempts = 0
+        self.url_successes = 0
+        self.url_wins = 0
+        self.base64_wins = 0
+        self.skipped = 0
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class PathSelector:
+    """按图片来源主机统计URL方式与base64方式的胜出情况
+
+    URL方式在某个主机上长期失败（如QQ多媒体、Telegram）时直接跳过，
+    但每隔 probe_interval 次仍会试探一次，以便主机恢复后重新启用。
+    """
+
+    def __init__(self, min_samples: int = 10, min_success_rate: float = 0.2, probe_interval: int = 20):
+        self.min_samples = min_samples
+        self.min_success_rate = min_success_rate
+        self.probe_interval = probe_interval
+        self._stats = {}  # host -> HostStats
+
+    def _get(self, host: str) -> HostStats:
+        stats = self._stats.get(host)
+        if stats is None:
+            stats = self._stats[host] = HostStats()
+        return stats
+
+    def should_try_url(self, host: str) -> bool:
+        stats = self._get(host)
+        if stats.url_attempts < self.min_samples:
+            return True
+        if stats.url_successes / stats.url_attempts >= self.min_success_rate:
+            return True
+        stats.skipped += 1
+        return stats.skipped % self.probe_interval == 0
+
+    def record(self, host: str, url_ok, winner: str):
+        """记录一次识别：url_ok 为None表示本次未尝试URL方式，winner 为 url/base64/None"""
+        stats = self._get(host)
+        if url_ok is not None:
+            stats.url_attempts += 1
+            if url_ok:
+                stats.url_successes += 1
+            # 衰减旧样本，让统计跟随主机状态变化
+            if stats.url_attempts >= 200:
+                stats.url_attempts //= 2
+                stats.url_successes //= 2
+        if winner == "url":
+            stats.url_wins += 1
+        elif winner == "base64":
+            stats.base64_wins += 1
+
+    def snapshot(self) -> dict:
+        return {host: stats.to_dict() for host, stats in self._stats.items()}
+
+    def restore(self, snapshot: dict) -> int:
+        """恢复 snapshot() 导出的统计（已有统计的主机不覆盖）"""
+        restored = 0
+        for host, values in snapshot.items():
+            if host in self._stats:
+                continue
+            stats = self._get(host)
+            for name in HostStats.__slots__:
+                setattr(stats, name, int(values.get(name, 0)))
+            restored += 1
+        return restored
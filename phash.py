@@ -0,0 +1,115 @@
+from collections import OrderedDict
+from itertools import combinations
+
+HASH_BITS = 64
+CHUNK_COUNT = 4
+CHUNK_BITS = HASH_BITS // CHUNK_COUNT
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+# 置位数少于该值（或多于 HASH_BITS 减该值）的哈希缺乏区分度
+MIN_HASH_BITS = 8
+
+
+def dhash(img) -> int:
+    """计算64位差值哈希（dHash），对重新压缩、缩放等变化不敏感"""
+    # reducing_gap 让 PIL 先用 reduce() 整数倍缩小，再精确缩放到9x8
+    small = img.convert("L").resize((9, 8), reducing_gap=2.0)
+    pixels = small.tobytes()  # L 模式每个像素一个字节
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def is_distinctive(h: int) -> bool:
+    """纯色、低纹理图片的哈希几乎全为0或全为1，彼此都“相似”，不能用于近似重复查找"""
+    bits = bin(h).count("1")
+    return MIN_HASH_BITS <= bits <= HASH_BITS - MIN_HASH_BITS
+
+
+def _chunk_masks(radius: int) -> list:
+    """生成所有汉明重量不超过radius的16位掩码"""
+    masks = [0]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), r):
+            mask = 0
+            for bit in bits:
+                mask |= 1 << bit
+            masks.append(mask)
+    return masks
+
+
+class HammingIndex:
+    """基于多索引哈希（Multi-Index Hashing）的近似重复查找
+
+    把64位哈希切成4段16位，分别建倒排表。根据抽屉原理，距离不超过d的两个哈希
+    至少有一段的距离不超过 d // 4，因此只需枚举少量段内变体即可精确找回所有候选，
+    查询开销与已存条目数基本无关。
+    """
+
+    def __init__(self, max_distance: int = 6, max_entries: int = 200000):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self._masks = _chunk_masks(max_distance // CHUNK_COUNT)
+        self._tables = [{} for _ in range(CHUNK_COUNT)]  # 段值 -> 哈希集合
+        self._values = OrderedDict()  # 哈希 -> 值（按插入顺序淘汰）
+
+    def __len__(self):
+        return len(self._values)
+
+    @staticmethod
+    def _chunks(h: int):
+        return [(h >> (i * CHUNK_BITS)) & CHUNK_MASK for i in range(CHUNK_COUNT)]
+
+    def add(self, h: int, value):
+        if h in self._values:
+            self._values[h] = value
+            self._values.move_to_end(h)
+            return
+        self._values[h] = value
+        for table, chunk in zip(self._tables, self._chunks(h)):
+            table.setdefault(chunk, set()).add(h)
+        while len(self._values) > self.max_entries:
+            self._remove(next(iter(self._values)))
+
+    def _remove(self, h: int):
+        del self._values[h]
+        for table, chunk in zip(self._tables, self._chunks(h)):
+            bucket = table.get(chunk)
+            if bucket is not None:
+                bucket.discard(h)
+                if not bucket:
+                    del table[chunk]
+
+    def search(self, h: int):
+        """查找距离最近且不超过阈值的条目，返回 (值, 距离)，未找到返回None"""
+        exact = self._values.get(h)
+        if exact is not None:
+            return exact, 0
+
+        best_hash = None
+        best_distance = self.max_distance + 1
+        seen = set()
+        for table, chunk in zip(self._tables, self._chunks(h)):
+            for mask in self._masks:
+                bucket = table.get(chunk ^ mask)
+                if not bucket:
+                    continue
+                for candidate in bucket:
+                    if candidate in seen:
+                        continue
+                    seen.add(candidate)
+                    distance = hamming(h, candidate)
+                    if distance < best_distance:
+                        best_hash, best_distance = candidate, distance
+        if best_hash is None:
+            return None
+        return self._values[best_hash], best_distance
+
+    def items(self):
+        return list(self._values.items())
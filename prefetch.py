@@ -0,0 +1,107 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+
+class Prefetcher:
+    """群聊图片预取队列
+
+    白名单群里出现的图片先放入有界队列（满时丢弃最早的），由后台任务在 ready() 为真
+    （识别接口有空闲容量）时逐个识别并写入缓存，之后引用该图片发送识别命令即可直接命中。
+    每个群每小时最多预取 group_budget 张，最近入队过的图片URL不会重复入队。
+    """
+
+    def __init__(
+        self,
+        runner,
+        ready=None,
+        max_queue: int = 50,
+        workers: int = 1,
+        group_budget: int = 30,
+        window_seconds: float = 3600,
+        poll_interval: float = 1.0,
+    ):
+        self.runner = runner  # async def runner(group_id, image_url)
+        self.ready = ready  # def ready() -> bool
+        self.poll_interval = poll_interval
+        self.workers = max(1, workers)
+        self.group_budget = group_budget
+        self.window_seconds = window_seconds
+        self._queue = deque(maxlen=max(1, max_queue))  # (group_id, image_url)
+        self._seen = OrderedDict()  # image_url -> None，最近入队过的图片
+        self._budgets = {}  # group_id -> deque[入队时间]
+        self._wakeup = None
+        self._tasks = []
+        self.enqueued = 0
+        self.dropped = 0
+        self.over_budget = 0
+        self.completed = 0
+        self.failed = 0
+
+    def offer(self, group_id: str, image_url: str) -> bool:
+        """尝试把图片加入预取队列，返回是否入队"""
+        if image_url in self._seen:
+            return False
+        now = time.monotonic()
+        history = self._budgets.get(group_id)
+        if history is None:
+            history = self._budgets[group_id] = deque()
+        while history and history[0] <= now - self.window_seconds:
+            history.popleft()
+        if len(history) >= self.group_budget:
+            self.over_budget += 1
+            return False
+        history.append(now)
+
+        self._seen[image_url] = None
+        if len(self._seen) > 4 * self._queue.maxlen + 256:
+            self._seen.popitem(last=False)
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1  # deque 满时 append 会丢弃最早的条目
+        self._queue.append((group_id, image_url))
+        self.enqueued += 1
+        self._ensure_workers()
+        self._wakeup.set()
+        return True
+
+    def _ensure_workers(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._tasks = [task for task in self._tasks if not task.done()]
+        loop = asyncio.get_running_loop()
+        while len(self._tasks) < self.workers:
+            self._tasks.append(loop.create_task(self._work()))
+
+    async def _work(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if self.ready is not None and not self.ready():
+                await asyncio.sleep(self.poll_interval)
+                continue
+            group_id, image_url = self._queue.popleft()
+            try:
+                await self.runner(group_id, image_url)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed += 1
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._queue.clear()
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._queue),
+            "enqueued": self.enqueued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "over_budget": self.over_budget,
+        }
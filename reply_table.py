@@ -0,0 +1,38 @@
+import time
+from collections import OrderedDict
+
+
+class ReplyTable:
+    """按识别结果缓存已生成的回复文本（LRU，ttl_seconds>0 时条目会过期）
+
+    热门角色的识别结果高度重复，相同结果集直接复用格式化好的回复或 LLM 总结。
+    """
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (文本, 过期时间)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or (entry[1] and entry[1] < time.monotonic()):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, text: str):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds > 0 else 0
+        self._entries[key] = (text, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
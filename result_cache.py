@@ -0,0 +1,152 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+from .sqlite_worker import SQLiteWorker
+
+
+def content_digest(data: bytes) -> str:
+    """计算图片内容哈希（用于按内容去重）"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class ResultCache:
+    """识别结果缓存：内存LRU（带TTL）+ 可选SQLite持久层
+
+    键由调用方通过 url_key / content_key 生成，值为 AnimeTrace 返回的 dict。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 86400, db_path: str = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._memory = OrderedDict()  # key -> (expires_at, value)
+        self._sqlite = SQLiteWorker(db_path, self._setup_db, "shitu-cache") if db_path else None
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    @staticmethod
+    def url_key(model: str, url: str) -> str:
+        return f"u:{model}:{url}"
+
+    @staticmethod
+    def content_key(model: str, digest: str) -> str:
+        return f"h:{model}:{digest}"
+
+    @staticmethod
+    def _setup_db(db):
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        db.execute("DELETE FROM results WHERE expires_at < ?", (time.time(),))
+        db.commit()
+
+    @staticmethod
+    def _db_get(db, key: str):
+        row = db.execute(
+            "SELECT value, expires_at FROM results WHERE key = ? AND expires_at >= ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    @staticmethod
+    def _db_put(db, key: str, value_json: str, expires_at: float):
+        db.execute(
+            "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value_json, expires_at),
+        )
+        db.commit()
+
+    def _remember(self, key: str, value: dict, expires_at: float):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get_memory(self, key: str):
+        """仅查询内存层（不计入命中统计），未命中或已过期返回None"""
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    async def get(self, key: str):
+        """查询缓存，依次查内存层与持久层"""
+        value = self.get_memory(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self._sqlite is not None:
+            row = await self._sqlite.run(self._db_get, key)
+            if row is not None:
+                value, expires_at = row
+                self._remember(key, value, expires_at)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def get_persisted(self, key: str):
+        """只查询持久层（不计入命中统计），用于读取其他进程刚写入的结果"""
+        if self._sqlite is None:
+            return None
+        row = await self._sqlite.run(self._db_get, key)
+        if row is None:
+            return None
+        value, expires_at = row
+        self._remember(key, value, expires_at)
+        return value
+
+    def snapshot(self) -> list:
+        """内存层中未过期的条目 [(键, 过期时间, 值)]，按最近使用顺序排列"""
+        now = time.time()
+        return [(key, expires_at, value) for key, (expires_at, value) in self._memory.items() if expires_at >= now]
+
+    def restore(self, entries) -> int:
+        """把快照中的条目放回内存层（不覆盖已有条目），返回恢复的条目数"""
+        now = time.time()
+        restored = 0
+        for key, expires_at, value in entries:
+            if expires_at >= now and key not in self._memory:
+                self._remember(key, value, expires_at)
+                restored += 1
+        return restored
+
+    async def put(self, key: str, value: dict):
+        """写入缓存（同时写入持久层）
+
+        没有识别到结果（或接口调用失败）时不写入，避免把一次偶然的失败持久化并共享给其他进程。
+        """
+        if not value.get("data"):
+            return
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, value, expires_at)
+        if self._sqlite is not None:
+            value_json = json.dumps(value, ensure_ascii=False)
+            await self._sqlite.run(self._db_put, key, value_json, expires_at)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+    def close(self):
+        if self._sqlite is not None:
+            self._sqlite.close()
+            self._sqlite = None
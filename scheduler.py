@@ -0,0 +1,209 @@
+import asyncio
+import contextvars
+import email.utils
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+# 当前请求的发起者 (群组ID, 用户ID, 是否限制单用户排队数)，由命令处理入口设置，供调度器做公平排队
+current_requester = contextvars.ContextVar("shitu_requester", default=("", "", True))
+
+
+class QueueFullError(Exception):
+    """调度队列已满，请求被拒绝"""
+
+
+def parse_retry_after(value: str):
+    """解析 Retry-After 头（秒数或HTTP日期），无法解析时返回None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class RequestScheduler:
+    """AnimeTrace 请求调度器
+
+    - 并发上限：同时进行的请求数不超过 max_in_flight
+    - 令牌桶限速：平均每秒 rate_per_second 个请求，允许 burst 个突发
+    - 公平排队：群组之间轮转，群组内用户之间轮转
+    - 过载保护：排队总数或单个用户排队数超限时直接拒绝
+    - 退避：收到 429/503 等信号后暂停派发
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 4,
+        rate_per_second: float = 2.0,
+        burst: int = 5,
+        max_queue: int = 50,
+        max_queue_per_user: int = 3,
+        max_backoff: float = 60.0,
+        global_limiter=None,
+    ):
+        self.max_in_flight = max(1, max_in_flight)
+        self.rate_per_second = rate_per_second
+        self.burst = max(1, burst)
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.max_backoff = max_backoff
+        self.global_limiter = global_limiter  # async def global_limiter()，如多进程共享的令牌桶
+
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+        self._in_flight = 0
+        self._queued = 0
+        self._groups = OrderedDict()  # group -> OrderedDict(user -> deque[Future])
+        self._paused_until = 0.0
+        self._backoff = 0.0
+        self._timer = None
+
+        self.dispatched = 0
+        self.rejected = 0
+        self.throttled = 0
+
+    def _refill(self, now: float):
+        if self.rate_per_second <= 0:
+            self._tokens = float(self.burst)
+            return
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate_per_second)
+        self._last_refill = now
+
+    def _next_waiter(self):
+        """按群组、用户两级轮转取出下一个等待者"""
+        while self._groups:
+            group, users = next(iter(self._groups.items()))
+            self._groups.move_to_end(group)
+            user, waiters = next(iter(users.items()))
+            users.move_to_end(user)
+            fut = waiters.popleft()
+            if not waiters:
+                del users[user]
+                if not users:
+                    del self._groups[group]
+            self._queued -= 1
+            if not fut.done():
+                return fut
+        return None
+
+    def _pump(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        while self._queued and self._in_flight < self.max_in_flight:
+            if now < self._paused_until:
+                self._schedule(self._paused_until - now)
+                return
+            self._refill(now)
+            if self._tokens < 1:
+                self._schedule((1 - self._tokens) / self.rate_per_second)
+                return
+            fut = self._next_waiter()
+            if fut is None:
+                return
+            self._tokens -= 1
+            self._in_flight += 1
+            self.dispatched += 1
+            fut.set_result(None)
+
+    def _schedule(self, delay: float):
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(delay, self._pump)
+
+    async def acquire(self, group: str = "", user: str = "", enforce_user_limit: bool = True):
+        """等待获得一个请求名额，队列已满时抛出 QueueFullError
+
+        enforce_user_limit 为False时不检查单用户排队上限（如批量识别，其并发已由调用方限制）。
+        """
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError("识别请求排队已满")
+        users = self._groups.get(group)
+        waiters = users.get(user) if users else None
+        if enforce_user_limit and waiters is not None and len(waiters) >= self.max_queue_per_user:
+            self.rejected += 1
+            raise QueueFullError("该用户排队中的识别请求过多")
+
+        fut = asyncio.get_running_loop().create_future()
+        if users is None:
+            users = self._groups[group] = OrderedDict()
+        if waiters is None:
+            waiters = users[user] = deque()
+        waiters.append(fut)
+        self._queued += 1
+        self._pump()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # 已获得名额但调用方被取消，归还名额
+                self.release()
+            else:
+                self._discard(group, user, fut)
+            raise
+
+    def _discard(self, group: str, user: str, fut):
+        users = self._groups.get(group)
+        waiters = users.get(user) if users else None
+        if waiters is None or fut not in waiters:
+            return
+        waiters.remove(fut)
+        self._queued -= 1
+        if not waiters:
+            del users[user]
+            if not users:
+                del self._groups[group]
+
+    def release(self):
+        self._in_flight -= 1
+        self._pump()
+
+    @asynccontextmanager
+    async def slot(self):
+        """以当前请求发起者的身份占用一个名额"""
+        group, user, enforce_user_limit = current_requester.get()
+        await self.acquire(group, user, enforce_user_limit)
+        try:
+            if self.global_limiter is not None:
+                await self.global_limiter()
+            yield
+        finally:
+            self.release()
+
+    def has_spare_capacity(self) -> bool:
+        """是否有空闲容量：没有排队、未在退避，且保留一个并发名额和一个令牌后仍有余量"""
+        now = time.monotonic()
+        if self._queued or now < self._paused_until:
+            return False
+        if self._in_flight >= max(1, self.max_in_flight - 1):
+            return False
+        self._refill(now)
+        return self.rate_per_second <= 0 or self._tokens >= min(2, self.burst)
+
+    def report_throttled(self, retry_after=None):
+        """上游返回限流/过载信号：按 Retry-After 或指数退避暂停派发"""
+        self.throttled += 1
+        if retry_after is None:
+            self._backoff = min(self.max_backoff, self._backoff * 2 if self._backoff else 1.0)
+            retry_after = self._backoff
+        self._paused_until = max(self._paused_until, time.monotonic() + min(retry_after, self.max_backoff))
+
+    def report_success(self):
+        self._backoff = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "dispatched": self.dispatched,
+            "rejected": self.rejected,
+            "throttled": self.throttled,
+            "paused_for": max(0.0, self._paused_until - time.monotonic()),
+        }
@@ -0,0 +1,127 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+
+
+class WaitingSession:
+    """等待用户发送图片的会话，只保存回复所需的最少信息"""
+
+    __slots__ = ("model", "expires_at", "unified_msg_origin")
+
+    def __init__(self, model: str, expires_at: float, unified_msg_origin: str):
+        self.model = model
+        self.expires_at = expires_at
+        self.unified_msg_origin = unified_msg_origin
+
+
+class WaitingSessionStore:
+    """等待会话存储
+
+    以 (平台, 群组, 用户) 为键；所有会话的超时由一个后台任务按最小堆统一处理，
+    而不是每个会话一个 sleep 任务。超过 max_sessions 时淘汰最早创建的会话。
+    """
+
+    def __init__(self, ttl_seconds: float, max_sessions: int = 1000, on_expire=None):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.on_expire = on_expire  # async def on_expire(key, session)
+        self._sessions = OrderedDict()  # key -> WaitingSession
+        self._heap = []  # (expires_at, seq, key)
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._reaper = None
+        self._notify_tasks = set()
+        self.evicted = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, key):
+        return key in self._sessions
+
+    def put(self, key, model: str, unified_msg_origin: str) -> WaitingSession:
+        """创建或覆盖会话"""
+        expires_at = time.monotonic() + self.ttl_seconds
+        session = WaitingSession(model, expires_at, unified_msg_origin)
+        self._sessions.pop(key, None)
+        self._sessions[key] = session
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+        entry = (expires_at, next(self._seq), key)
+        heapq.heappush(self._heap, entry)
+        if len(self._heap) > 2 * len(self._sessions) + 64:
+            self._compact()
+        self._ensure_reaper()
+        if self._heap[0] is entry:
+            self._wakeup.set()  # 新会话最早到期，唤醒后台任务重新计算等待时间
+        return session
+
+    def get(self, key):
+        """获取未过期的会话"""
+        session = self._sessions.get(key)
+        if session is None or session.expires_at < time.monotonic():
+            return None
+        return session
+
+    def pop(self, key):
+        """取出并删除未过期的会话"""
+        session = self.get(key)
+        if session is not None:
+            del self._sessions[key]
+        return session
+
+    def _compact(self):
+        """清理堆中已失效的条目"""
+        self._heap = [
+            entry for entry in self._heap
+            if (session := self._sessions.get(entry[2])) is not None and session.expires_at == entry[0]
+        ]
+        heapq.heapify(self._heap)
+
+    def _ensure_reaper(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.get_running_loop().create_task(self._reap())
+
+    async def _reap(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self._heap[0][0] - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            expires_at, _, key = heapq.heappop(self._heap)
+            session = self._sessions.get(key)
+            if session is None or session.expires_at != expires_at:
+                continue  # 会话已被取走或已被新会话覆盖
+            del self._sessions[key]
+            self.expired += 1
+            if self.on_expire is not None:
+                # 超时提示在独立任务中发送，避免慢速发送拖延后续会话的超时处理
+                task = asyncio.get_running_loop().create_task(self.on_expire(key, session))
+                self._notify_tasks.add(task)
+                task.add_done_callback(self._notify_tasks.discard)
+
+    def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        self._sessions.clear()
+        self._heap.clear()
+
+    def stats(self) -> dict:
+        return {"waiting": len(self._sessions), "expired": self.expired, "evicted": self.evicted}
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import time
+import uuid
+
+from .sqlite_worker import SQLiteWorker
+
+
+class SharedState:
+    """同一主机上多个进程共享的状态（SQLite WAL 模式）
+
+    - 租约：同一键同一时刻只有一个进程在识别，其他进程等待其写入共享结果缓存
+    - 全局令牌桶：所有进程共用一个上游请求速率预算
+    识别结果本身由 ResultCache 写入同一个数据库文件。
+    """
+
+    def __init__(self, db_path: str, lease_seconds: float = 90, poll_interval: float = 0.25):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # isolation_level=None：由各操作显式开启事务
+        self._sqlite = SQLiteWorker(db_path, self._setup_db, "shitu-shared", isolation_level=None)
+        self.claimed = 0
+        self.peer_waits = 0
+        self.token_waits = 0
+
+    @staticmethod
+    def _setup_db(db):
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def _claim(self, db, key: str) -> bool:
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM leases WHERE key = ? AND expires_at < ?", (key, now))
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, self.owner, now + self.lease_seconds),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return cursor.rowcount == 1
+
+    def _release(self, db, key: str):
+        db.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, self.owner))
+
+    @staticmethod
+    def _take_token(db, name: str, rate: float, burst: int) -> float:
+        """取一个令牌，成功返回0，否则返回需要等待的秒数"""
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+            tokens = float(burst) if row is None else min(burst, row[0] + max(0.0, now - row[1]) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            db.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)", (name, tokens, now))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return wait
+
+    async def claim(self, key: str) -> bool:
+        """尝试获得键的租约（已过期的租约视为不存在）"""
+        if await self._sqlite.run(self._claim, key):
+            self.claimed += 1
+            return True
+        return False
+
+    async def release(self, key: str):
+        await self._sqlite.run(self._release, key)
+
+    async def acquire_token(self, name: str, rate: float, burst: int):
+        """从全局令牌桶取一个令牌，不足时等待"""
+        while True:
+            wait = await self._sqlite.run(self._take_token, name, rate, burst)
+            if wait <= 0:
+                return
+            self.token_waits += 1
+            await asyncio.sleep(wait)
+
+    def stats(self) -> dict:
+        return {"claimed": self.claimed, "peer_waits": self.peer_waits, "token_waits": self.token_waits}
+
+    def close(self):
+        self._sqlite.close()
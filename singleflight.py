@@ -0,0 +1,45 @@
+import asyncio
+
+
+class SingleFlight:
+    """合并相同键的并发请求：同一时刻只执行一次，其余调用共享同一个结果"""
+
+    def __init__(self):
+        self._calls = {}  # key -> [asyncio.Task, 等待者数量]
+        self.executed = 0
+        self.shared = 0
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, factory):
+        """执行 factory() 并返回结果；若相同key的调用正在进行则等待其结果"""
+        call = self._calls.get(key)
+        if call is not None:
+            self.shared += 1
+        else:
+            self.executed += 1
+            task = asyncio.ensure_future(factory())
+            call = self._calls[key] = [task, 0]
+            task.add_done_callback(lambda t: self._forget(key, t))
+        task = call[0]
+        call[1] += 1
+        try:
+            # shield：某个等待者被取消时不影响其他等待者
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if call[1] == 1 and not task.done():
+                task.cancel()  # 最后一个等待者也放弃了，不再继续执行
+            raise
+        finally:
+            call[1] -= 1
+
+    def _forget(self, key, task):
+        call = self._calls.get(key)
+        if call is not None and call[0] is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # 标记异常已被读取，避免无人等待时输出警告
+
+    def stats(self) -> dict:
+        return {"executed": self.executed, "shared": self.shared, "in_flight": len(self._calls)}
@@ -0,0 +1,36 @@
+import json
+import os
+import zlib
+
+SNAPSHOT_MAGIC = b"SHITU\x00"
+SNAPSHOT_VERSION = 1
+
+
+def dump_snapshot(path: str, state: dict) -> int:
+    """把热状态写入快照文件（JSON + zlib 压缩，先写临时文件再替换），返回写入字节数"""
+    payload = zlib.compress(json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC + bytes([SNAPSHOT_VERSION]) + payload)
+    os.replace(tmp_path, path)
+    return len(payload) + len(SNAPSHOT_MAGIC) + 1
+
+
+def load_snapshot(path: str):
+    """读取快照文件，文件不存在、版本不符或已损坏时返回None"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    header = SNAPSHOT_MAGIC + bytes([SNAPSHOT_VERSION])
+    if not data.startswith(header):
+        return None
+    try:
+        state = json.loads(zlib.decompress(data[len(header):]).decode("utf-8"))
+    except (zlib.error, ValueError):
+        return None
+    return state if isinstance(state, dict) else None
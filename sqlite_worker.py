@@ -0,0 +1,51 @@
+import asyncio
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SQLiteWorker:
+    """只在单个工作线程中使用的 SQLite 连接（WAL 模式）
+
+    所有数据库操作都提交到这个线程执行，既不阻塞事件循环，也不需要给连接加锁。
+    操作函数的第一个参数为连接：func(db, *args)。
+    """
+
+    def __init__(self, db_path: str, setup=None, thread_name: str = "shitu-sqlite", **connect_kwargs):
+        self.db_path = db_path
+        self._db = None
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=thread_name)
+        try:
+            self._executor.submit(self._open, setup, connect_kwargs).result()
+        except BaseException:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            raise
+
+    def _open(self, setup, connect_kwargs: dict):
+        self._db = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False, **connect_kwargs)
+        # WAL 模式：多个进程共用同一个数据库文件时读写互不阻塞
+        self._db.execute("PRAGMA journal_mode=WAL")
+        if setup is not None:
+            setup(self._db)
+
+    def _call(self, func, args: tuple):
+        return func(self._db, *args)
+
+    async def run(self, func, *args):
+        """在工作线程中执行 func(db, *args)"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._call, func, args)
+
+    def run_sync(self, func, *args):
+        """同步执行 func(db, *args)（用于关闭前落盘等不在事件循环中的场景）"""
+        return self._executor.submit(self._call, func, args).result()
+
+    def close(self):
+        if self._executor is None:
+            return
+        if self._db is not None:
+            self._executor.submit(self._db.close).result()
+            self._db = None
+        self._executor.shutdown(wait=False)
+        self._executor = None
@@ -0,0 +1,38 @@
+import asyncio
+import importlib.machinery
+import importlib.util
+import pathlib
+import sys
+
+import pytest
+
+# 插件目录本身是一个包（模块之间使用相对导入），测试时以插件名注册该包
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+PACKAGE = "astrbot_plugin_shitu"
+
+if PACKAGE not in sys.modules:
+    spec = importlib.machinery.ModuleSpec(PACKAGE, None, is_package=True)
+    spec.submodule_search_locations = [str(ROOT)]
+    sys.modules[PACKAGE] = importlib.util.module_from_spec(spec)
+
+
+@pytest.fixture
+def run():
+    """在新的事件循环中运行协程"""
+    return asyncio.run
+
+
+@pytest.fixture
+def make_plugin():
+    """插件实例工厂：默认不限速、关闭识别历史与快照，API 地址指向不可达端口"""
+    pytest.importorskip("astrbot")
+    from astrbot_plugin_shitu.main import AnimeTracePlugin
+
+    def factory(**settings):
+        config = {"scheduler_rate_per_second": 0, "history_enabled": False, "snapshot_enabled": False}
+        config.update(settings)
+        plugin = AnimeTracePlugin(None, {"shitu_settings": config})
+        plugin.api_url = "http://127.0.0.1:9/v1/search"
+        return plugin
+
+    return factory
@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("astrbot")
+
+from astrbot_plugin_shitu.breaker import OPEN  # noqa: E402
+from astrbot_plugin_shitu.main import AnimeTracePlugin  # noqa: E402
+
+
+@pytest.fixture
+def make_plugin(make_plugin):
+    """单并发、熔断器两次失败即打开"""
+
+    def factory(**settings):
+        config = {"scheduler_max_in_flight": 1, "circuit_min_samples": 2, "circuit_open_seconds": 0.01}
+        config.update(settings)
+        return make_plugin(**config)
+
+    return factory
+
+
+def trip_breaker(plugin: AnimeTracePlugin):
+    for _ in range(2):
+        plugin.breaker.record(False, 0.1, plugin.breaker.before_call())
+    assert plugin.breaker.state == OPEN
+    time.sleep(0.02)  # 冷却结束，下一个请求将成为半开探测
+
+
+@pytest.mark.parametrize("call", ["post_search", "url"])
+def test_probe_released_when_cancelled_in_queue(call, run, make_plugin):
+    async def main():
+        plugin = make_plugin()
+        trip_breaker(plugin)
+        await plugin.scheduler.acquire()  # 占住唯一的名额
+        if call == "post_search":
+            task = asyncio.ensure_future(plugin.post_search({}, "multipart", "pre_stable"))
+        else:
+            task = asyncio.ensure_future(plugin.call_animetrace_api_with_url("http://x/1.jpg", "pre_stable"))
+        await asyncio.sleep(0.01)
+        assert plugin.breaker.is_open()  # 探测请求正在排队
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert not plugin.breaker.is_open()
+        assert plugin.breaker.before_call() is True
+        await plugin.terminate()
+
+    run(main())
+
+
+def test_probe_released_when_queue_full(run, make_plugin):
+    async def main():
+        plugin = make_plugin(scheduler_max_queue=0)
+        trip_breaker(plugin)
+        with pytest.raises(Exception):
+            await plugin.post_search({}, "multipart", "pre_stable")
+        assert not plugin.breaker.is_open()
+        await plugin.terminate()
+
+    run(main())
+
+
+def test_url_mode_queue_full_returns_empty_result(run, make_plugin):
+    async def main():
+        plugin = make_plugin(scheduler_max_queue=0)
+        assert await plugin.call_animetrace_api_with_url("http://x/1.jpg", "pre_stable") == {"data": []}
+        assert not plugin.breaker.is_open()
+        await plugin.terminate()
+
+    run(main())
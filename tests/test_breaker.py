@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+from astrbot_plugin_shitu.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+def open_breaker(**kwargs) -> CircuitBreaker:
+    breaker = CircuitBreaker(min_samples=2, window=4, open_seconds=0.01, **kwargs)
+    for _ in range(2):
+        breaker.record(False, 0.1, breaker.before_call())
+    assert breaker.state == OPEN
+    return breaker
+
+
+def test_opens_on_failure_rate_and_rejects():
+    breaker = CircuitBreaker(min_samples=2, window=4, open_seconds=60)
+    breaker.record(True, 0.1, breaker.before_call())
+    assert breaker.state == CLOSED
+    breaker.record(False, 0.1, breaker.before_call())
+    assert breaker.state == OPEN
+    assert breaker.is_open()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_slow_calls_count_as_failures():
+    breaker = CircuitBreaker(min_samples=2, window=4, slow_call_seconds=1)
+    for _ in range(2):
+        breaker.record(True, 2.0, breaker.before_call())
+    assert breaker.state == OPEN
+
+
+def test_half_open_allows_single_probe():
+    breaker = open_breaker()
+    time.sleep(0.02)
+    assert not breaker.is_open()
+    assert breaker.before_call() is True
+    assert breaker.state == HALF_OPEN
+    assert breaker.is_open()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_probe_success_closes():
+    breaker = open_breaker()
+    time.sleep(0.02)
+    probe = breaker.before_call()
+    breaker.record(True, 0.1, probe)
+    assert breaker.state == CLOSED
+    assert breaker.before_call() is False
+
+
+def test_probe_failure_reopens_with_longer_cooldown():
+    breaker = open_breaker()
+    time.sleep(0.02)
+    breaker.record(False, 0.1, breaker.before_call())
+    assert breaker.state == OPEN
+    assert breaker.retry_in() > 0.01
+
+
+def test_cancelled_probe_is_released():
+    breaker = open_breaker()
+    time.sleep(0.02)
+    probe = breaker.before_call()
+    breaker.record(None, 0.0, probe)
+    assert breaker.state == HALF_OPEN
+    assert not breaker.is_open()
+    assert breaker.before_call() is True
+
+
+def test_stale_call_does_not_consume_probe():
+    breaker = open_breaker()
+    time.sleep(0.02)
+    probe = breaker.before_call()
+    # 打开前就已发出的请求此时才返回，不能占用或结束半开探测
+    breaker.record(True, 0.1, False)
+    assert breaker.state == HALF_OPEN
+    assert breaker.is_open()
+    breaker.record(True, 0.1, probe)
+    assert breaker.state == CLOSED
+
+
+def test_adaptive_timeout_follows_p95():
+    breaker = CircuitBreaker(min_samples=5, min_timeout=1, max_timeout=30, timeout_multiplier=3)
+    assert breaker.request_timeout() == 30
+    for _ in range(10):
+        breaker.record(True, 0.5, breaker.before_call())
+    assert breaker.request_timeout() == pytest.approx(1.5)
+    for _ in range(10):
+        breaker.record(True, 0.1, breaker.before_call())
+    assert breaker.request_timeout() == pytest.approx(1.5)  # p95 仍是0.5秒
@@ -0,0 +1,67 @@
+import asyncio
+import sqlite3
+
+from astrbot_plugin_shitu.history import RecognitionHistory, bigrams
+
+
+def count_records(db_path) -> int:
+    with sqlite3.connect(db_path) as db:
+        return db.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+
+def test_bigrams_normalize_width_and_case():
+    assert bigrams("Ｒｅ:０") == bigrams("re:0") == {"re", "e:", ":0"}
+    assert bigrams("雷") == set()
+
+
+def test_search_matches_fragments_within_scope(tmp_path, run):
+    async def main():
+        history = RecognitionHistory(str(tmp_path / "history.db"), batch_size=100, flush_seconds=60)
+        history.record("group:1", "pre_stable", "h1", [("雷姆", "Re:从零开始的异世界生活"), ("拉姆", "Re:从零开始的异世界生活")])
+        history.record("group:1", "pre_stable", "h2", [("雷姆", "Re:从零开始的异世界生活")])
+        history.record("group:2", "pre_stable", "h3", [("Saber", "Fate/stay night")])
+
+        matches = await history.search("group:1", "雷姆")
+        assert [(m["character"], m["count"]) for m in matches] == [("雷姆", 2)]
+        assert len(matches[0]["recent"]) == 2
+        assert {m["character"] for m in await history.search("group:1", "从零")} == {"雷姆", "拉姆"}
+        assert {m["character"] for m in await history.search("group:1", "姆")} == {"雷姆", "拉姆"}
+        assert await history.search("group:1", "saber") == []
+        assert [m["character"] for m in await history.search("group:2", "SABER")] == ["Saber"]
+        history.close()
+
+    run(main())
+
+
+def test_full_batches_during_a_write_are_not_lost(tmp_path, run):
+    db_path = str(tmp_path / "history.db")
+
+    async def main():
+        history = RecognitionHistory(db_path, batch_size=5, flush_seconds=60)
+        searches = []
+        for i in range(500):
+            history.record(f"group:{i % 3}", "pre_stable", str(i), [(f"角色{i % 50}", "作品")])
+            if i % 7 == 0:
+                # 查询排在工作线程队列中，与后台写入交错
+                searches.append(asyncio.ensure_future(history.search("group:0", "角色")))
+            if i % 3 == 0:
+                await asyncio.sleep(0)
+        await asyncio.gather(*searches)
+        await asyncio.sleep(0.05)
+        history.close()
+
+    run(main())
+    assert count_records(db_path) == 500
+
+
+def test_close_writes_pending_records(tmp_path, run):
+    db_path = str(tmp_path / "history.db")
+
+    async def main():
+        history = RecognitionHistory(db_path, batch_size=100, flush_seconds=60)
+        history.record("group:1", "pre_stable", "h", [("A", "W")])
+        assert history.stats()["pending"] == 1
+        history.close()
+
+    run(main())
+    assert count_records(db_path) == 1
@@ -0,0 +1,44 @@
+import io
+
+import pytest
+
+from astrbot_plugin_shitu.phash import HammingIndex, dhash, hamming, is_distinctive
+
+Image = pytest.importorskip("PIL.Image")
+ImageDraw = pytest.importorskip("PIL.ImageDraw")
+
+
+def textured():
+    img = Image.new("RGB", (180, 160), "white")
+    draw = ImageDraw.Draw(img)
+    for i in range(0, 180, 30):
+        draw.rectangle((i, (i * 7) % 120, i + 12, (i * 7) % 120 + 40), fill="black")
+    return img
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "L", "P", "CMYK"])
+def test_flat_images_are_not_distinctive(mode):
+    assert not is_distinctive(dhash(Image.new(mode, (64, 64))))
+
+
+def test_textured_image_is_distinctive_and_survives_recompression():
+    img = textured()
+    h = dhash(img)
+    assert is_distinctive(h)
+    buffer = io.BytesIO()
+    img.resize((90, 80)).save(buffer, "JPEG", quality=40)
+    buffer.seek(0)
+    assert hamming(h, dhash(Image.open(buffer))) <= 6
+
+
+def test_index_finds_nearest_within_distance():
+    index = HammingIndex(max_distance=6, max_entries=2)
+    base = 0x0F0F_3C3C_5A5A_A5A5
+    index.add(base, "a")
+    index.add(base ^ 0b111, "b")
+    assert index.search(base) == ("a", 0)
+    assert index.search(base ^ 0b1) == ("a", 1)
+    assert index.search(base ^ (0x7F << 20)) is None
+    index.add(base ^ (0xFF << 40), "c")  # 超出容量，淘汰最早的条目
+    assert len(index) == 2
+    assert index.search(base) == ("b", 3)
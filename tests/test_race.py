@@ -0,0 +1,150 @@
+import asyncio
+import io
+
+import pytest
+
+pytest.importorskip("astrbot")
+
+from astrbot_plugin_shitu.result_cache import ResultCache, content_digest  # noqa: E402
+
+RESULT = {"data": [{"character": [{"character": "A", "work": "W"}]}]}
+
+
+def test_cancelled_url_call_is_not_counted_as_failure(run, make_plugin):
+    async def main():
+        plugin = make_plugin()
+
+        async def slow_url(image_url, model, dispatched=None):
+            await asyncio.sleep(10)
+
+        async def fast_download(image_url, model, fire_base64, url_won=None):
+            return RESULT  # 如命中内容缓存，无需等待对冲信号
+
+        plugin.call_animetrace_api_with_url = slow_url
+        plugin.recognize_by_download = fast_download
+        for i in range(15):
+            assert await plugin.race_recognize(f"http://host/{i}.jpg", "pre_stable", f"k{i}") == RESULT
+        stats = plugin.path_selector.snapshot()["host"]
+        assert stats["url_attempts"] == 0
+        assert stats["base64_wins"] == 15
+        assert plugin.path_selector.should_try_url("host")
+        await plugin.terminate()
+
+    run(main())
+
+
+
+def test_hedge_delay_starts_when_url_request_is_dispatched(run, make_plugin):
+    async def main():
+        plugin = make_plugin(scheduler_max_in_flight=1, hedge_delay_seconds=0.01)
+        signals = []
+
+        async def download(image_url, model, fire_base64, url_won=None):
+            signals.append(fire_base64)
+            await fire_base64.wait()
+            return RESULT
+
+        plugin.recognize_by_download = download
+        release = asyncio.Event()
+
+        async def hold_slot():
+            async with plugin.scheduler.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(hold_slot())
+        await asyncio.sleep(0)
+        race = asyncio.create_task(plugin.race_recognize("http://host/1.jpg", "pre_stable", "k"))
+        await asyncio.sleep(0.1)
+        # URL请求仍在排队，对冲延迟尚未开始计时
+        assert not signals[0].is_set()
+        release.set()
+        await holder
+        # URL请求发出后连接失败，随即发出base64请求
+        assert await race == RESULT
+        assert signals[0].is_set()
+        await plugin.terminate()
+
+    run(main())
+
+
+def test_url_win_still_learns_image_content(run, make_plugin):
+    async def main():
+        from PIL import Image, ImageDraw
+
+        img = Image.new("RGB", (200, 200), "white")
+        ImageDraw.Draw(img).rectangle((20, 40, 120, 180), fill="black")
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG")
+        img_bytes = buffer.getvalue()
+
+        plugin = make_plugin()
+        plugin.result_cache = ResultCache(100, 3600)
+
+        async def fast_url(image_url, model, dispatched=None):
+            return RESULT
+
+        async def slow_download(image_url):
+            await asyncio.sleep(0.05)  # 下载比URL方式慢，URL方式先胜出
+            return img_bytes
+
+        async def no_upload(img_data, model):
+            raise AssertionError("URL方式胜出后不应再上传图片")
+
+        plugin.call_animetrace_api_with_url = fast_url
+        plugin.download_image = slow_download
+        plugin.call_animetrace_api_with_image = no_upload
+        assert await plugin.race_recognize("http://host/a.jpg", "pre_stable", "k") == RESULT
+        assert plugin.background_tasks
+        await asyncio.gather(*plugin.background_tasks)
+
+        content_key = ResultCache.content_key("pre_stable", content_digest(img_bytes))
+        assert await plugin.result_cache.get(content_key) == RESULT
+        assert len(plugin.phash_indexes["pre_stable"]) == 1
+        await plugin.terminate()
+
+    run(main())
+
+
+def test_url_win_after_hedge_cancels_upload(run, make_plugin):
+    async def main():
+        from PIL import Image, ImageDraw
+
+        img = Image.new("RGB", (200, 200), "white")
+        ImageDraw.Draw(img).ellipse((30, 30, 150, 170), fill="black")
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG")
+        img_bytes = buffer.getvalue()
+
+        plugin = make_plugin(hedge_delay_seconds=0.01)
+        plugin.result_cache = ResultCache(100, 3600)
+        uploads = []
+
+        async def slow_url(image_url, model, dispatched=None):
+            dispatched.set()
+            await asyncio.sleep(0.1)  # 超过对冲延迟，base64请求已发出
+            return RESULT
+
+        async def download(image_url):
+            return img_bytes
+
+        async def slow_upload(img_data, model):
+            uploads.append("started")
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                uploads.append("cancelled")
+                raise
+
+        plugin.call_animetrace_api_with_url = slow_url
+        plugin.download_image = download
+        plugin.call_animetrace_api_with_image = slow_upload
+        assert await plugin.race_recognize("http://host/b.jpg", "pre_stable", "k") == RESULT
+        await asyncio.wait_for(asyncio.gather(*plugin.background_tasks), 1)
+
+        assert uploads == ["started", "cancelled"]
+        content_key = ResultCache.content_key("pre_stable", content_digest(img_bytes))
+        assert await plugin.result_cache.get(content_key) == RESULT
+        assert len(plugin.phash_indexes["pre_stable"]) == 1
+        await plugin.terminate()
+
+    run(main())
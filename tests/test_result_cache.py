@@ -0,0 +1,35 @@
+from astrbot_plugin_shitu.result_cache import ResultCache
+
+
+def test_empty_results_are_not_cached(tmp_path, run):
+    async def main():
+        cache = ResultCache(db_path=str(tmp_path / "cache.db"))
+        try:
+            await cache.put("u:m:empty", {"data": []})
+            await cache.put("u:m:failed", {})
+            await cache.put("u:m:found", {"data": [{"character": [{"character": "a", "work": "b"}]}]})
+            assert await cache.get("u:m:empty") is None
+            assert await cache.get("u:m:failed") is None
+            assert await cache.get_persisted("u:m:empty") is None
+            assert (await cache.get("u:m:found"))["data"]
+        finally:
+            cache.close()
+
+    run(main())
+
+
+def test_persisted_results_survive_reopen(tmp_path, run):
+    async def main():
+        db_path = str(tmp_path / "cache.db")
+        cache = ResultCache(db_path=db_path)
+        await cache.put("h:m:1", {"data": [1]})
+        cache.close()
+
+        reopened = ResultCache(db_path=db_path)
+        try:
+            assert await reopened.get("h:m:1") == {"data": [1]}
+            assert reopened.disk_hits == 1
+        finally:
+            reopened.close()
+
+    run(main())
@@ -0,0 +1,171 @@
+import asyncio
+import time
+
+import pytest
+
+from astrbot_plugin_shitu.scheduler import QueueFullError, RequestScheduler, current_requester, parse_retry_after
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("12") == 12.0
+    assert parse_retry_after("") is None
+    assert parse_retry_after("not a date") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+def test_max_in_flight(run):
+    async def main():
+        scheduler = RequestScheduler(max_in_flight=1, rate_per_second=0)
+        await scheduler.acquire("g", "a")
+        waiter = asyncio.ensure_future(scheduler.acquire("g", "b"))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        assert scheduler.stats()["queued"] == 1
+        scheduler.release()
+        await asyncio.wait_for(waiter, 1)
+        assert scheduler.stats()["in_flight"] == 1
+
+    run(main())
+
+
+def test_fair_queue_rotates_groups_and_users(run):
+    async def main():
+        scheduler = RequestScheduler(max_in_flight=1, rate_per_second=0, max_queue_per_user=10)
+        await scheduler.acquire("blocker", "x")
+        order = []
+
+        async def request(group, user, name):
+            await scheduler.acquire(group, user)
+            order.append(name)
+            scheduler.release()
+
+        tasks = [
+            asyncio.ensure_future(request(group, user, name))
+            for group, user, name in (
+                ("A", "a1", "A-a1-1"), ("A", "a1", "A-a1-2"), ("A", "a2", "A-a2-1"), ("B", "b1", "B-b1-1"),
+            )
+        ]
+        await asyncio.sleep(0.01)
+        scheduler.release()
+        await asyncio.wait_for(asyncio.gather(*tasks), 1)
+        # 群组之间轮转，群组内用户之间轮转
+        assert order == ["A-a1-1", "B-b1-1", "A-a2-1", "A-a1-2"]
+
+    run(main())
+
+
+def test_queue_limits(run):
+    async def main():
+        scheduler = RequestScheduler(max_in_flight=1, rate_per_second=0, max_queue=3, max_queue_per_user=2)
+        await scheduler.acquire("g", "u")
+        waiters = [asyncio.ensure_future(scheduler.acquire("g", "u")) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            await scheduler.acquire("g", "u")
+        # 不限制单用户排队数时只受总队列长度约束
+        waiters.append(asyncio.ensure_future(scheduler.acquire("g", "u", enforce_user_limit=False)))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            await scheduler.acquire("g", "other")
+        assert scheduler.stats()["rejected"] == 2
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        assert scheduler.stats()["queued"] == 0
+
+    run(main())
+
+
+def test_token_bucket_spaces_requests(run):
+    async def main():
+        scheduler = RequestScheduler(max_in_flight=10, rate_per_second=20, burst=1)
+        started = time.monotonic()
+        for _ in range(3):
+            await scheduler.acquire()
+            scheduler.release()
+        # 突发1个，之后每个间隔约50ms
+        assert time.monotonic() - started >= 0.09
+
+    run(main())
+
+
+def test_cancel_while_queued_removes_waiter(run):
+    async def main():
+        scheduler = RequestScheduler(max_in_flight=1, rate_per_second=0)
+        await scheduler.acquire("g", "a")
+        waiter = asyncio.ensure_future(scheduler.acquire("g", "b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert scheduler.stats()["queued"] == 0
+        scheduler.release()
+        assert scheduler.stats()["in_flight"] == 0
+
+    run(main())
+
+
+def test_cancel_after_grant_releases_slot(run):
+    async def main():
+        scheduler = RequestScheduler(max_in_flight=1, rate_per_second=0)
+        await scheduler.acquire("g", "a")
+        granted = asyncio.ensure_future(scheduler.acquire("g", "b"))
+        await asyncio.sleep(0)
+        scheduler.release()  # 名额交给 granted，但它还没来得及恢复执行
+        assert scheduler.stats()["in_flight"] == 1
+        granted.cancel()
+        await asyncio.gather(granted, return_exceptions=True)
+        assert scheduler.stats()["in_flight"] == 0
+        # 名额已归还，后续请求不会被卡住
+        await asyncio.wait_for(scheduler.acquire("g", "c"), 1)
+
+    run(main())
+
+
+def test_slot_releases_on_error_and_uses_requester(run):
+    async def main():
+        scheduler = RequestScheduler(max_in_flight=1, rate_per_second=0, max_queue_per_user=1)
+        token = current_requester.set(("g", "u", True))
+        try:
+            with pytest.raises(RuntimeError):
+                async with scheduler.slot():
+                    assert scheduler.stats()["in_flight"] == 1
+                    raise RuntimeError
+        finally:
+            current_requester.reset(token)
+        assert scheduler.stats()["in_flight"] == 0
+
+    run(main())
+
+
+def test_global_limiter_cancel_releases_slot(run):
+    async def main():
+        async def never():
+            await asyncio.sleep(10)
+
+        scheduler = RequestScheduler(max_in_flight=1, rate_per_second=0, global_limiter=never)
+
+        async def use():
+            async with scheduler.slot():
+                pass
+
+        task = asyncio.ensure_future(use())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert scheduler.stats()["in_flight"] == 0
+
+    run(main())
+
+
+def test_report_throttled_pauses_dispatch(run):
+    async def main():
+        scheduler = RequestScheduler(max_in_flight=2, rate_per_second=0)
+        scheduler.report_throttled(0.1)
+        started = time.monotonic()
+        await scheduler.acquire()
+        assert time.monotonic() - started >= 0.09
+        assert not scheduler.has_spare_capacity()
+        scheduler.release()
+        assert scheduler.has_spare_capacity()
+
+    run(main())
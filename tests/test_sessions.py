@@ -0,0 +1,89 @@
+import asyncio
+
+from astrbot_plugin_shitu.sessions import WaitingSessionStore
+
+
+def test_put_get_pop(run):
+    async def main():
+        store = WaitingSessionStore(10)
+        store.put("k", "model", "origin")
+        assert "k" in store
+        assert store.get("k").model == "model"
+        assert store.pop("k").unified_msg_origin == "origin"
+        assert store.pop("k") is None
+        store.close()
+
+    run(main())
+
+
+def test_expiry_calls_on_expire_once(run):
+    async def main():
+        expired = []
+
+        async def on_expire(key, session):
+            expired.append((key, session.model))
+
+        store = WaitingSessionStore(0.05, on_expire=on_expire)
+        store.put("a", "m", "o")
+        store.put("b", "m", "o")
+        store.pop("b")  # 已取走的会话不会超时
+        await asyncio.sleep(0.15)
+        assert expired == [("a", "m")]
+        assert store.stats()["expired"] == 1
+        assert len(store) == 0
+        store.close()
+
+    run(main())
+
+
+def test_overwrite_keeps_latest_deadline(run):
+    async def main():
+        expired = []
+
+        async def on_expire(key, session):
+            expired.append(session.model)
+
+        store = WaitingSessionStore(0.1, on_expire=on_expire)
+        store.put("k", "old", "o")
+        await asyncio.sleep(0.06)
+        store.put("k", "new", "o")
+        await asyncio.sleep(0.07)
+        # 旧会话的到期时间已过，但被覆盖后不应触发超时
+        assert expired == []
+        assert store.get("k").model == "new"
+        await asyncio.sleep(0.08)
+        assert expired == ["new"]
+        store.close()
+
+    run(main())
+
+
+def test_earlier_deadline_wakes_reaper(run):
+    async def main():
+        expired = []
+
+        async def on_expire(key, session):
+            expired.append(key)
+
+        store = WaitingSessionStore(10, on_expire=on_expire)
+        store.put("late", "m", "o")
+        await asyncio.sleep(0)
+        store.ttl_seconds = 0.05
+        store.put("early", "m", "o")
+        await asyncio.sleep(0.15)
+        assert expired == ["early"]
+        store.close()
+
+    run(main())
+
+
+def test_evicts_oldest_over_limit(run):
+    async def main():
+        store = WaitingSessionStore(10, max_sessions=2)
+        for key in ("a", "b", "c"):
+            store.put(key, "m", "o")
+        assert "a" not in store and "b" in store and "c" in store
+        assert store.stats()["evicted"] == 1
+        store.close()
+
+    run(main())